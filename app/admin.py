@@ -1,77 +1,55 @@
 from aiogram import Bot, Router, F
-from aiogram import Dispatcher, types
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram import types
+from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
-from aiosqlite import connect
-from contextlib import asynccontextmanager
-from typing import Dict, Any, Optional, Tuple
-from datetime import datetime, timedelta
-import asyncio
+from functools import wraps
+from typing import Dict
 import structlog
-from contextvars import ContextVar
 
-from app.utils.schedule import admin_create_schedule
+from app.utils.schedule import send_schedule
+from app.utils.mailing import MailingWorker
+from app.keyboards import user_ticket_keyboard
+from app.programs import PROGRAMS, program_title
+from app.utils.notify import notify_admins
 from bd.database import get_user_data, save_answer, get_user_id_by_question_id, get_question_by_message_id, \
-    get_question_and_username_by_message_id, save_ticket_message, get_ticket_messages, close_ticket, get_ticket_history, \
-    get_user_id_by_ticket_message_id, get_ticket_id_by_message_id, get_username_by_user_id
+    save_ticket_message, close_ticket, get_ticket_history, get_admin_message_route, \
+    create_mailing_job, count_user_ids, get_programs, slow_queries
 from app.fsm_clases.feadback_class import Mailing
-from setings import ADMIN_ID, TOKEN, PHOTO_PATH
+from setings import ADMIN_ID, PHOTO_PATH
 
 # Configure structured logging
 logger = structlog.get_logger(__name__)
 
 # Initialize core components
-dp = Dispatcher(storage=MemoryStorage())
-bot = Bot(TOKEN)
 admin_router = Router()
 
-# Database and caching setup
-db_pool = ContextVar('db_pool', default=None)
-cache = {}
-CACHE_TIMEOUT = 300  # 5 minutes
-BATCH_SIZE = 30  # Number of messages to send in one batch
-
-async def get_data_for_admin(user_id: int) -> None:
+async def get_data_for_admin(bot: Bot, user_id: int) -> None:
     """Get and send user data to all admins with error handling"""
     try:
-        user_data = get_user_data(user_id)
+        user_data = await get_user_data(user_id)
         if user_data:
             response = (
                 f"Пользователь выбрал программу: {user_id}:\n\n"
-                f"User ID: {user_data[1]}\n"
-                f"Номер телефона: {user_data[2]}\n"
-                f"Имя: {user_data[3]}\n"
-                f"Вид программы: {user_data[4]}\n"
-                f"Никнейм в телеграмме: @{user_data[5]}"
+                f"User ID: {user_data['user_id']}\n"
+                f"Номер телефона: {user_data['phone_number']}\n"
+                f"Имя: {user_data['first_name']}\n"
+                f"Вид программы: {program_title(user_data['program_id'])}\n"
+                f"Никнейм в телеграмме: @{user_data['username']}"
             )
         else:
             response = f"Данные для user_id {user_id} не найдены."
 
-        for admin_id in ADMIN_ID:
-            await bot.send_message(chat_id=admin_id, text=response)
+        await notify_admins(bot, response)
     except Exception as e:
         logger.error(f"Error in get_data_for_admin: {e}")
-        for admin_id in ADMIN_ID:
-            await bot.send_message(
-                chat_id=admin_id,
-                text="Произошла ошибка при получении данных пользователя."
-            )
-
-@asynccontextmanager
-async def get_db_connection():
-    """Context manager for database connections with connection pooling"""
-    if db_pool.get() is None:
-        async with connect('users.db') as db:
-            db_pool.set(db)
-            yield db
-    else:
-        yield db_pool.get()
+        await notify_admins(bot, "Произошла ошибка при получении данных пользователя.")
 
 def handle_error(func):
     """Decorator for consistent error handling"""
 
+    # wraps() lets aiogram see the handler's own signature and inject only what it asks for
+    @wraps(func)
     async def wrapper(*args, **kwargs):
         try:
             return await func(*args, **kwargs)
@@ -87,49 +65,46 @@ def handle_error(func):
 
     return wrapper
 
-async def get_cached_user_data(user_id: int) -> Optional[Tuple]:
-    """Get user data with caching"""
-    current_time = datetime.now()
-    if user_id in cache:
-        data, timestamp = cache[user_id]
-        if current_time - timestamp < timedelta(seconds=CACHE_TIMEOUT):
-            return data
-
-    user_data = get_user_data(user_id)
-    if user_data:
-        cache[user_id] = (user_data, current_time)
-    return user_data
-
-async def send_message_to_user(user_id: int, data: Dict[str, Any]) -> bool:
-    """Send a message to a single user with error handling"""
-    try:
-        if data.get("photo"):
-            await bot.send_photo(
-                chat_id=user_id,
-                photo=data["photo"],
-                caption=data.get("caption", "")
-            )
-        else:
-            await bot.send_message(chat_id=user_id, text=data["text"])
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send message to {user_id}", error=str(e))
-        return False
-
-async def send_batch_messages(users: list, data: Dict[str, Any], batch_size: int = BATCH_SIZE):
-    """Send messages in batches to avoid rate limiting"""
-    for i in range(0, len(users), batch_size):
-        batch = users[i:i + batch_size]
-        tasks = [send_message_to_user(user_id[0], data) for user_id in batch]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        await asyncio.sleep(1)  # Rate limiting pause between batches
-        yield sum(1 for r in results if r is True), sum(1 for r in results if r is False)
-
 @admin_router.message(F.text == "/schedule", F.from_user.id.in_(ADMIN_ID))
 @handle_error
 async def schedule(message: Message):
-    await admin_create_schedule()
-    await message.answer_photo(types.FSInputFile(path="/home/chel/PycharmProjects/RecordBot2.0/schedule.png"))
+    await send_schedule(message)
+
+SLOW_QUERIES_LIMIT = 5  # Statements shown by /slow_queries without an argument
+MESSAGE_LIMIT = 4096  # Telegram's limit for a text message
+QUERY_TEXT_LIMIT = 300  # Characters of SQL and plan shown per statement
+
+def _shorten(text: str, limit: int = QUERY_TEXT_LIMIT) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+@admin_router.message(F.text.startswith("/slow_queries"), F.from_user.id.in_(ADMIN_ID))
+@handle_error
+async def show_slow_queries(message: Message):
+    """/slow_queries [N]: statements that took the most database time since startup"""
+    argument = message.text.removeprefix("/slow_queries").strip()
+    limit = int(argument) if argument.isdigit() else SLOW_QUERIES_LIMIT
+    queries = slow_queries(limit)
+    if queries is None:
+        await message.answer("Профилирование запросов выключено (DB_PROFILE_THRESHOLD в setings.py)")
+        return
+    if not queries:
+        await message.answer("Запросов пока не было")
+        return
+
+    text = "Запросы с наибольшим суммарным временем:"
+    for n, query in enumerate(queries, start=1):
+        entry = (
+            f"\n\n{n}. {query.total * 1000:.0f} мс всего, {query.count} раз, "
+            f"в среднем {query.average * 1000:.2f} мс, максимум {query.max * 1000:.2f} мс"
+            f"{' — ПОЛНОЕ СКАНИРОВАНИЕ' if query.full_scan else ''}\n"
+            f"{_shorten(query.sql)}"
+        )
+        if query.plan:
+            entry += f"\nПлан: {_shorten('; '.join(query.plan))}"
+        if len(text) + len(entry) > MESSAGE_LIMIT:
+            break
+        text += entry
+    await message.answer(text)
 
 @admin_router.message(F.text == "рассылка", F.from_user.id.in_(ADMIN_ID))
 @handle_error
@@ -164,7 +139,7 @@ async def process_mailing_photo(message: Message, state: FSMContext):
         await state.set_state(Mailing.photo_send)
     elif message.text.lower() == "нет":
         await state.update_data(photo=None, caption=None)
-        await confirm_mailing(message, state)
+        await ask_segment(message, state)
     else:
         await message.answer("Пожалуйста, используйте кнопки 'Да' или 'Нет'.")
 
@@ -182,11 +157,70 @@ async def process_photo(message: Message, state: FSMContext):
 async def process_caption(message: Message, state: FSMContext):
     """Process the caption for the photo"""
     await state.update_data(caption=message.text or "")
+    await ask_segment(message, state)
+
+SEGMENT_ALL = "Все пользователи"
+SEGMENT_PHONE = "С номером телефона"
+SEGMENT_PROGRAM = "По программе"
+
+async def chosen_programs() -> Dict[str, int]:
+    """Title -> id of the programs at least one user has chosen"""
+    return {PROGRAMS[program_id].title: program_id for program_id in await get_programs() if program_id in PROGRAMS}
+
+async def ask_segment(message: Message, state: FSMContext):
+    """Ask who should receive the mailing"""
+    builder = ReplyKeyboardBuilder()
+    for text in (SEGMENT_ALL, SEGMENT_PHONE, SEGMENT_PROGRAM):
+        builder.add(types.KeyboardButton(text=text))
+    builder.adjust(1)
+    await message.answer(
+        "Кому отправить рассылку?",
+        reply_markup=builder.as_markup(resize_keyboard=True)
+    )
+    await state.set_state(Mailing.segment)
+
+@admin_router.message(Mailing.segment)
+@handle_error
+async def process_segment(message: Message, state: FSMContext):
+    """Handle the choice of the recipients segment"""
+    if message.text == SEGMENT_ALL:
+        await state.update_data(segment_program_id=None, segment_has_phone=False)
+        await confirm_mailing(message, state)
+    elif message.text == SEGMENT_PHONE:
+        await state.update_data(segment_program_id=None, segment_has_phone=True)
+        await confirm_mailing(message, state)
+    elif message.text == SEGMENT_PROGRAM:
+        programs = await chosen_programs()
+        if not programs:
+            await message.answer("Пока никто не выбрал программу.")
+            return
+        builder = ReplyKeyboardBuilder()
+        for title in programs:
+            builder.add(types.KeyboardButton(text=title))
+        builder.adjust(1)
+        await message.answer(
+            "Выберите программу:",
+            reply_markup=builder.as_markup(resize_keyboard=True)
+        )
+        await state.set_state(Mailing.segment_program)
+    else:
+        await message.answer("Пожалуйста, используйте кнопки.")
+
+@admin_router.message(Mailing.segment_program)
+@handle_error
+async def process_segment_program(message: Message, state: FSMContext):
+    """Handle the program whose users should receive the mailing"""
+    program_id = (await chosen_programs()).get(message.text)
+    if program_id is None:
+        await message.answer("Пожалуйста, выберите программу с помощью кнопок.")
+        return
+    await state.update_data(segment_program_id=program_id, segment_has_phone=False)
     await confirm_mailing(message, state)
 
 async def confirm_mailing(message: Message, state: FSMContext):
     """Show the mailing preview and ask for confirmation"""
     data = await state.get_data()
+    recipients = await count_user_ids(data.get("segment_program_id"), data.get("segment_has_phone", False))
 
     if data.get("photo"):
         await message.answer_photo(
@@ -199,37 +233,34 @@ async def confirm_mailing(message: Message, state: FSMContext):
     builder = ReplyKeyboardBuilder()
     builder.add(types.KeyboardButton(text="Да"), types.KeyboardButton(text="Нет"))
     await message.answer(
-        "Вы уверены, что хотите отправить это?",
+        f"Получателей: {recipients}. Вы уверены, что хотите отправить это?",
         reply_markup=builder.as_markup(resize_keyboard=True)
     )
     await state.set_state(Mailing.confirm)
 
 @admin_router.message(Mailing.confirm)
 @handle_error
-async def send_mailing(message: Message, state: FSMContext):
-    """Send the mailing to all users with batch processing"""
+async def send_mailing(message: Message, state: FSMContext, mailing_worker: MailingWorker):
+    """Queue the mailing as a job, the mailing worker delivers it and reports progress"""
     if message.text.lower() != "да":
         await message.answer("Рассылка отменена.", reply_markup=types.ReplyKeyboardRemove())
         await state.clear()
         return
 
     data = await state.get_data()
-    total_success = 0
-    total_fail = 0
 
     try:
-        async with get_db_connection() as db:
-            async with db.execute("SELECT user_id FROM users") as cursor:
-                users = await cursor.fetchall()
-
-        async for success, fail in send_batch_messages(users, data):
-            total_success += success
-            total_fail += fail
+        job_id = await create_mailing_job(
+            message.chat.id, data.get("text"), data.get("photo"), data.get("caption"),
+            data.get("segment_program_id"), data.get("segment_has_phone", False)
+        )
+        if job_id is None:
+            await message.answer("Произошла ошибка при рассылке.", reply_markup=types.ReplyKeyboardRemove())
+            return
 
+        mailing_worker.wake()
         await message.answer(
-            f"Рассылка завершена.\n"
-            f"Успешно отправлено: {total_success}\n"
-            f"Не удалось отправить: {total_fail}",
+            f"Рассылка #{job_id} поставлена в очередь. Прогресс будет показан в следующем сообщении.",
             reply_markup=types.ReplyKeyboardRemove()
         )
     except Exception as e:
@@ -240,55 +271,30 @@ async def send_mailing(message: Message, state: FSMContext):
 
 @admin_router.message(F.reply_to_message, F.from_user.id.in_(ADMIN_ID))
 @handle_error
-async def answer_question(message: Message, **kwargs):
+async def answer_question(message: Message, bot: Bot):
     """Обработка ответа администратора на вопросы пользователей"""
     admin_id = message.from_user.id
     if message.from_user.id not in ADMIN_ID:
         await message.answer("У вас нет прав для выполнения этой команды.")
         return
 
-    admin_index = ADMIN_ID.index(message.from_user.id)
-    question_message_id = message.reply_to_message.message_id - (admin_index + 1)
     answer = message.text
 
-    print(f"Handling answer for message_id={question_message_id}")
-
-    # Получение user_id из базы данных
-    user_id = get_user_id_by_ticket_message_id(question_message_id)
-
-    if not user_id:
-        print(f"User not found for message_id={question_message_id}")
-        await message.answer("❌ Пользователь для этого вопроса не найден.")
+    # Уведомление, на которое ответил администратор, записано при его отправке
+    route = await get_admin_message_route(admin_id, message.reply_to_message.message_id)
+    if not route:
+        await message.answer("❌ Вопрос не найден в базе данных.")
         return
 
-    print(f"Found user_id={user_id} for message_id={question_message_id}")
-
-    # Получение вопроса и username из базы данных
-    question, username = get_question_and_username_by_message_id(question_message_id)
-
-    if not question:
-        # Try to find the question by ticket_id if message_id is not found
-        ticket_id = get_ticket_id_by_message_id(question_message_id)
-        if ticket_id:
-            questions = get_ticket_messages(ticket_id)
-            if questions:
-                question = questions[-1]['question']
-                username = get_username_by_user_id(user_id)
-            else:
-                await message.answer("❌ Вопрос не найден в базе данных.")
-                return
-        else:
-            await message.answer("❌ Вопрос не найден в базе данных.")
-            return
+    ticket_id, user_id, question_message_id, question, username = route
+    logger.info("Handling answer", ticket_id=ticket_id, user_id=user_id, message_id=question_message_id)
 
     # Попытка доставить сообщение пользователю
     try:
-        ticket_id = get_ticket_id_by_message_id(question_message_id)
         await bot.send_message(
             chat_id=user_id,
-            text=f"Ответ на ваш вопрос:\n\n{answer}\n\n В случае если Вы получили ответ на свой вопрос или он стал не актуален нажмите на кнопку ниже", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Закрыть тикет", callback_data=f"user_close_ticket_{ticket_id}")]
-        ]))
+            text=f"Ответ на ваш вопрос:\n\n{answer}\n\n В случае если Вы получили ответ на свой вопрос или он стал не актуален нажмите на кнопку ниже",
+            reply_markup=user_ticket_keyboard(ticket_id))
         await message.answer("✅ Ответ успешно доставлен пользователю.")
     except Exception as e:
         error_message = "❌ Не удалось доставить ответ пользователю.\n"
@@ -303,19 +309,18 @@ async def answer_question(message: Message, **kwargs):
         await message.answer(error_message)
 
     # Сохранение ответа в базе данных
-    save_answer(question_message_id, answer, admin_id)
-
-    admin_info = await bot.get_chat(message.from_user.id)
-    admin_username = admin_info.username or admin_info.first_name
-
-    for other_admin_id in ADMIN_ID:
-        if other_admin_id != message.from_user.id:
-            await bot.send_message(
-                chat_id=other_admin_id,
-                text=(f"Администратор @{admin_username} ответил на вопрос от пользователя @{username}:\n\n"
-                      f"Вопрос: {question}\n\n"
-                      f"Ответ: {answer}")
-            )
+    await save_answer(ticket_id, user_id, question_message_id, answer, admin_id)
+
+    # Имя администратора уже есть в сообщении, отдельный get_chat не нужен
+    admin_username = message.from_user.username or message.from_user.first_name
+
+    await notify_admins(
+        bot,
+        (f"Администратор @{admin_username} ответил на вопрос от пользователя @{username}:\n\n"
+         f"Вопрос: {question}\n\n"
+         f"Ответ: {answer}"),
+        exclude=admin_id
+    )
 
     # # Вывод информации о тикете
     # ticket_id = get_ticket_id_by_message_id(question_message_id)
@@ -0,0 +1,32 @@
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+
+from app.utils.broadcast import Broadcaster
+from app.utils.mailing import MailingWorker
+from setings import TOKEN, BOT_API_CONNECTIONS
+
+
+@dataclass
+class AppContext:
+    """Objects shared by the whole application, created once at startup.
+
+    There is a single Bot, so every handler, the mailing worker and the admin notifications
+    reuse the same HTTP session and its keep-alive connections to the Bot API. Handlers get
+    the bot from aiogram and everything else through workflow_data().
+    """
+    bot: Bot
+    broadcaster: Broadcaster
+    mailing_worker: MailingWorker
+
+    @classmethod
+    def create(cls, token: str = TOKEN, connections: int = BOT_API_CONNECTIONS) -> 'AppContext':
+        bot = Bot(token, session=AiohttpSession(limit=connections))
+        broadcaster = Broadcaster(bot)
+        return cls(bot=bot, broadcaster=broadcaster, mailing_worker=MailingWorker(bot, broadcaster))
+
+    def workflow_data(self) -> Dict[str, Any]:
+        """Extra handler arguments, passed to the Dispatcher"""
+        return {'broadcaster': self.broadcaster, 'mailing_worker': self.mailing_worker}
@@ -11,4 +11,6 @@ class Mailing(StatesGroup):
     photo = State()
     photo_send = State()
     caption = State()
+    segment = State()
+    segment_program = State()
     confirm = State()
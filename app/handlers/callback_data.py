@@ -1,14 +1,12 @@
-from aiogram import Router, Bot, types
+from aiogram import Router, Bot, F
 from aiogram.types import CallbackQuery
-from setings import TOKEN, PHOTO_PATH
-from app.keyboards import contact_keyboard, inline_keyboard_back, inline_keyboard
+from app.keyboards import contact_keyboard, inline_keyboard_back, inline_keyboard, trainers_keyboard
 from bd.database import save_user_program, get_phone_number
-from app.text import program_1, program_2, program_3, program_4, program_5, program_6, program_7, program_8, \
-    program_list
-from app.utils.schedule import admin_create_schedule
+from app.programs import CALLBACK_PREFIX, program_from_callback
+from app.text import program_list
+from app.utils.schedule import send_schedule, current_schedule, lessons_on, lessons_of_trainer
 
 router = Router()
-bot = Bot(TOKEN)
 text = """Для получения программы отправьте Ваш номер телефона
 """
 
@@ -20,160 +18,60 @@ async def program(callback_query: CallbackQuery):
 
 @router.callback_query(lambda c: c.data == "schedule")
 async def schedule(callback_query: CallbackQuery):
-    await admin_create_schedule()
-    await callback_query.message.answer_photo(types.FSInputFile(path=PHOTO_PATH))
+    await send_schedule(callback_query.message)
 
 
-@router.callback_query(lambda c: c.data == 'back')
-async def back(callback_query: CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                text=program_list, reply_markup=inline_keyboard)
-
-
-@router.callback_query(lambda c: c.data == 'program_1')
-async def process_callback_program_1(callback_query: CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    is_phone = get_phone_number(callback_query.from_user.id)
-
-    if is_phone:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=program_1, reply_markup=inline_keyboard_back)
-    else:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=text)
-        await bot.send_message(chat_id=callback_query.from_user.id,
-                               text="Для отправки контакта нажмите на кнопку «Отправить контакт»",
-                               reply_markup=contact_keyboard)
-        save_user_program(user_id=callback_query.from_user.id,
-                          program="Тренировки для подростка 12-14лет от Владимира Мелтникова")
-
-
-@router.callback_query(lambda c: c.data == 'program_2')
-async def process_callback_program_1(callback_query: CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    is_phone = get_phone_number(callback_query.from_user.id)
-
-    if is_phone:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=program_2, reply_markup=inline_keyboard_back)
-    else:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=text)
-        await bot.send_message(chat_id=callback_query.from_user.id,
-                               text="Для отправки контакта нажмите на кнопку «Отправить контакт»",
-                               reply_markup=contact_keyboard)
-        save_user_program(user_id=callback_query.from_user.id,
-                          program="Сила и выносливость ног: комплекс для настоящих бойцов от Сергея Бронникова")
+@router.callback_query(lambda c: c.data == "schedule_today")
+async def schedule_today(callback_query: CallbackQuery):
+    await callback_query.answer()
+    await callback_query.message.answer(lessons_on(await current_schedule(), days_ahead=0))
 
 
-@router.callback_query(lambda c: c.data == 'program_3')
-async def process_callback_program_1(callback_query: CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
+@router.callback_query(lambda c: c.data == "schedule_tomorrow")
+async def schedule_tomorrow(callback_query: CallbackQuery):
+    await callback_query.answer()
+    await callback_query.message.answer(lessons_on(await current_schedule(), days_ahead=1))
 
-    is_phone = get_phone_number(callback_query.from_user.id)
 
-    if is_phone:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=program_3, reply_markup=inline_keyboard_back)
-    else:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=text)
-        await bot.send_message(chat_id=callback_query.from_user.id,
-                               text="Для отправки контакта нажмите на кнопку «Отправить контакт»",
-                               reply_markup=contact_keyboard)
-        save_user_program(user_id=callback_query.from_user.id,
-                          program="Тонус и рельеф: путь к идеальному телу от Анастасии Мельниковой")
+@router.callback_query(lambda c: c.data == "schedule_trainers")
+async def schedule_trainers(callback_query: CallbackQuery):
+    await callback_query.answer()
+    schedule = await current_schedule()
+    if not schedule:
+        await callback_query.message.answer("Расписание сейчас недоступно, попробуйте позже.")
+        return
+    await callback_query.message.answer("Выберите тренера:", reply_markup=trainers_keyboard(schedule.trainers))
 
 
-@router.callback_query(lambda c: c.data == 'program_4')
-async def process_callback_program_1(callback_query: CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
+@router.callback_query(F.data.startswith("trainer_"))
+async def schedule_trainer(callback_query: CallbackQuery):
+    await callback_query.answer()
+    text = lessons_of_trainer(await current_schedule(), callback_query.data.split("_", 1)[1])
+    await callback_query.message.answer(text or "Этого тренера нет в текущем расписании.")
 
-    is_phone = get_phone_number(callback_query.from_user.id)
 
-    if is_phone:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=program_4, reply_markup=inline_keyboard_back)
-    else:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=text)
-        await bot.send_message(chat_id=callback_query.from_user.id,
-                               text="Для отправки контакта нажмите на кнопку «Отправить контакт»",
-                               reply_markup=contact_keyboard)
-        save_user_program(user_id=callback_query.from_user.id,
-                          program="Красивые и соблазнительные ягодицы от Анастасии Мельниковой")
-
-
-@router.callback_query(lambda c: c.data == 'program_5')
-async def process_callback_program_1(callback_query: CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-
-    is_phone = get_phone_number(callback_query.from_user.id)
-
-    if is_phone:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=program_5, reply_markup=inline_keyboard_back)
-    else:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=text)
-        await bot.send_message(chat_id=callback_query.from_user.id,
-                               text="Для отправки контакта нажмите на кнопку «Отправить контакт»",
-                               reply_markup=contact_keyboard)
-        save_user_program(user_id=callback_query.from_user.id,
-                          program="Архитектура спины: создаем идеальные дельты от Любовь Сткляниной")
-
-
-@router.callback_query(lambda c: c.data == 'program_6')
-async def process_callback_program_1(callback_query: CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-
-    is_phone = get_phone_number(callback_query.from_user.id)
-
-    if is_phone:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=program_6, reply_markup=inline_keyboard_back)
-    else:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=text)
-        await bot.send_message(chat_id=callback_query.from_user.id,
-                               text="Для отправки контакта нажмите на кнопку «Отправить контакт»",
-                               reply_markup=contact_keyboard)
-        save_user_program(user_id=callback_query.from_user.id, program="Сила и форма: трансформация широчайшей мышцы")
-
-
-@router.callback_query(lambda c: c.data == 'program_7')
-async def process_callback_program_1(callback_query: CallbackQuery):
+@router.callback_query(lambda c: c.data == 'back')
+async def back(callback_query: CallbackQuery, bot: Bot):
     await bot.answer_callback_query(callback_query.id)
-    is_phone = get_phone_number(callback_query.from_user.id)
-
-    if is_phone:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=program_7, reply_markup=inline_keyboard_back)
-    else:
-        await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=text)
-        await bot.send_message(chat_id=callback_query.from_user.id,
-                               text="Для отправки контакта нажмите на кнопку «Отправить контакт»",
-                               reply_markup=contact_keyboard)
-        save_user_program(user_id=callback_query.from_user.id,
-                          program="Бицепс на максимум: раскрой свой потенциал от Рузиля Газизова")
+    await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
+                                text=program_list, reply_markup=inline_keyboard)
 
 
-@router.callback_query(lambda c: c.data == 'program_8')
-async def process_callback_program_1(callback_query: CallbackQuery):
+@router.callback_query(F.data.startswith(CALLBACK_PREFIX))
+async def process_callback_program(callback_query: CallbackQuery, bot: Bot):
+    program = program_from_callback(callback_query.data)
     await bot.answer_callback_query(callback_query.id)
-
-    is_phone = get_phone_number(callback_query.from_user.id)
+    if program is None:
+        return
+    is_phone = await get_phone_number(callback_query.from_user.id)
 
     if is_phone:
         await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
-                                    text=program_8, reply_markup=inline_keyboard_back)
+                                    text=program.text, reply_markup=inline_keyboard_back)
     else:
         await bot.edit_message_text(chat_id=callback_query.from_user.id, message_id=callback_query.message.message_id,
                                     text=text)
         await bot.send_message(chat_id=callback_query.from_user.id,
                                text="Для отправки контакта нажмите на кнопку «Отправить контакт»",
                                reply_markup=contact_keyboard)
-        save_user_program(user_id=callback_query.from_user.id,
-                          program="«Прокачай свои грудные» от тренера Рузиля Газизова")
+        await save_user_program(user_id=callback_query.from_user.id, program_id=program.id)
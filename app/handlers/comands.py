@@ -10,5 +10,5 @@ router = Router()
 @router.message(F.text == "/start")
 async def send_welcome(message: Message):
     user_id = message.from_user.id
-    add_user_if_not_exists(user_id)
+    await add_user_if_not_exists(user_id)
     await message.reply(welcome, reply_markup=general_menu)
@@ -1,21 +1,13 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+from app.programs import CALLBACK_PREFIX, PROGRAMS
+
+# One button per program of the catalog, four in a row
+_program_buttons = [InlineKeyboardButton(text=str(program_id), callback_data=f"{CALLBACK_PREFIX}{program_id}")
+                    for program_id in PROGRAMS]
 inline_keyboard = InlineKeyboardMarkup(
-    inline_keyboard=[
-        [
-            InlineKeyboardButton(text="1", callback_data='program_1'),
-            InlineKeyboardButton(text="2", callback_data='program_2'),
-            InlineKeyboardButton(text="3", callback_data='program_3'),
-            InlineKeyboardButton(text="4", callback_data='program_4'),
-        ],
-        [
-            InlineKeyboardButton(text="5", callback_data='program_5'),
-            InlineKeyboardButton(text="6", callback_data='program_6'),
-            InlineKeyboardButton(text="7", callback_data='program_7'),
-            InlineKeyboardButton(text="8", callback_data='program_8'),
-        ]
-    ]
+    inline_keyboard=[_program_buttons[i:i + 4] for i in range(0, len(_program_buttons), 4)]
 )
 
 inline_keyboard_back = InlineKeyboardMarkup(
@@ -36,6 +28,13 @@ general_menu = InlineKeyboardMarkup(
         [
             InlineKeyboardButton(text="Расписание на неделю", callback_data="schedule"),
         ],
+        [
+            InlineKeyboardButton(text="На сегодня", callback_data="schedule_today"),
+            InlineKeyboardButton(text="На завтра", callback_data="schedule_tomorrow"),
+        ],
+        [
+            InlineKeyboardButton(text="Расписание тренера", callback_data="schedule_trainers"),
+        ],
         [
             InlineKeyboardButton(text="Программы тренировок", callback_data="program"),
         ],
@@ -45,3 +44,26 @@ general_menu = InlineKeyboardMarkup(
     ]
 )
 
+
+def trainers_keyboard(trainers):
+    """Inline keyboard with one button per trainer, trainers maps key -> name"""
+    buttons = [InlineKeyboardButton(text=name, callback_data=f"trainer_{key}") for key, name in trainers.items()]
+    return InlineKeyboardMarkup(inline_keyboard=[buttons[i:i + 2] for i in range(0, len(buttons), 2)])
+
+
+def admin_ticket_keyboard(ticket_id, user_id=None):
+    """Actions on a ticket under a notification sent to admins"""
+    rows = [
+        [InlineKeyboardButton(text="Закрыть вопрос", callback_data=f"close_ticket_{ticket_id}")],
+        [InlineKeyboardButton(text="История сообщений", callback_data=f"history_{ticket_id}")],
+    ]
+    if user_id is not None:
+        rows.append([InlineKeyboardButton(text="Данные пользователя", callback_data=f"user_data_{user_id}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def user_ticket_keyboard(ticket_id):
+    """Lets the user close their own ticket"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Закрыть вопрос", callback_data=f"user_close_ticket_{ticket_id}")]
+    ])
@@ -0,0 +1,54 @@
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from app.text import program_1, program_2, program_3, program_4, program_5, program_6, program_7, program_8
+
+
+@dataclass(frozen=True)
+class Program:
+    id: int
+    title: str
+    trainer: Optional[str]
+    text: str
+    # Title stored in users.program before programs were stored by id
+    legacy_title: str
+
+
+PROGRAMS: Dict[int, Program] = {program.id: program for program in (
+    Program(1, "Тренировки для подростка 12-14лет", "Владимир Мелтников", program_1,
+            "Тренировки для подростка 12-14лет от Владимира Мелтникова"),
+    Program(2, "Сила и выносливость ног: комплекс для настоящих бойцов", "Сергей Бронников", program_2,
+            "Сила и выносливость ног: комплекс для настоящих бойцов от Сергея Бронникова"),
+    Program(3, "Тонус и рельеф: путь к идеальному телу", "Анастасия Мельникова", program_3,
+            "Тонус и рельеф: путь к идеальному телу от Анастасии Мельниковой"),
+    Program(4, "Красивые и соблазнительные ягодицы", "Анастасия Мельникова", program_4,
+            "Красивые и соблазнительные ягодицы от Анастасии Мельниковой"),
+    Program(5, "Архитектура спины: создаем идеальные дельты", "Любовь Стклянина", program_5,
+            "Архитектура спины: создаем идеальные дельты от Любовь Сткляниной"),
+    Program(6, "Сила и форма: трансформация широчайшей мышцы", None, program_6,
+            "Сила и форма: трансформация широчайшей мышцы"),
+    Program(7, "Бицепс на максимум: раскрой свой потенциал", "Рузиль Газизов", program_7,
+            "Бицепс на максимум: раскрой свой потенциал от Рузиля Газизова"),
+    Program(8, "«Прокачай свои грудные»", "Рузиль Газизов", program_8,
+            "«Прокачай свои грудные» от тренера Рузиля Газизова"),
+)}
+
+CALLBACK_PREFIX = "program_"
+
+
+def program_from_callback(data: str) -> Optional[Program]:
+    """'program_3' -> the third program, None for anything else"""
+    program_id = data[len(CALLBACK_PREFIX):]
+    return PROGRAMS.get(int(program_id)) if program_id.isdigit() else None
+
+
+def program_title(program_id: Optional[int]) -> str:
+    program = PROGRAMS.get(program_id)
+    if program is None:
+        return "не выбрана"
+    return f"{program.title} ({program.trainer})" if program.trainer else program.title
+
+
+def legacy_titles() -> Dict[str, int]:
+    """Stored title -> program id, for migrating users.program"""
+    return {program.legacy_title: program.id for program in PROGRAMS.values()}
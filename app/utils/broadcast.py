@@ -0,0 +1,148 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Union
+
+import structlog
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError, \
+    TelegramRetryAfter, TelegramServerError
+
+from app.utils.media import is_local_file, send_photos
+from bd.database import mark_user_blocked
+
+logger = structlog.get_logger(__name__)
+
+# Bot API allows about 30 messages per second to different chats, stay below it
+BROADCAST_RATE = 25
+MAX_CONCURRENCY = 20  # Requests in flight at once
+MAX_RETRIES = 3  # For network and server errors, flood waits are retried without a limit
+RETRY_BACKOFF = 1.0  # Seconds, doubled on every retry
+
+SENT = 'sent'
+FAILED = 'failed'
+BLOCKED = 'blocked'
+
+
+class TokenBucket:
+    """Paces requests to `rate` per second, a RetryAfter pauses every sender"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Flood control is per bot, so nobody sends until it is over"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        # Refill starts when the pause ends, not from the last send before it
+        self._updated = self._paused_until
+
+
+@dataclass
+class BroadcastStats:
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def add(self, result: str) -> None:
+        setattr(self, result, getattr(self, result) + 1)
+
+
+class Broadcaster:
+    """Sends one message to many users within the Bot API limits"""
+
+    def __init__(self, bot: Bot, rate: float = BROADCAST_RATE, concurrency: int = MAX_CONCURRENCY,
+                 max_retries: int = MAX_RETRIES):
+        self.bot = bot
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+
+    async def _send(self, user_id: int, data: Dict[str, Any]) -> None:
+        if is_local_file(data.get("photo")):
+            await send_photos(self.bot, user_id, [data["photo"]], data.get("caption", ""))
+        elif data.get("photo"):
+            await self.bot.send_photo(chat_id=user_id, photo=data["photo"], caption=data.get("caption", ""))
+        else:
+            await self.bot.send_message(chat_id=user_id, text=data["text"])
+
+    async def deliver(self, user_id: int, data: Dict[str, Any]) -> str:
+        """Send to one user, returns SENT, FAILED or BLOCKED"""
+        retries = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self._send(user_id, data)
+                return SENT
+            except TelegramRetryAfter as e:
+                logger.warning("Flood control, pausing mailing", user_id=user_id, retry_after=e.retry_after)
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                await mark_user_blocked(user_id)
+                return BLOCKED
+            except TelegramBadRequest as e:
+                logger.error(f"Failed to send message to {user_id}", error=str(e))
+                return FAILED
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if retries >= self.max_retries:
+                    logger.error(f"Failed to send message to {user_id}", error=str(e))
+                    return FAILED
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** retries)
+                retries += 1
+            except Exception as e:
+                logger.error(f"Failed to send message to {user_id}", error=str(e))
+                return FAILED
+
+    async def run(self, user_ids: Union[Iterable[int], AsyncIterable[int]], data: Dict[str, Any],
+                  on_result: Optional[Callable[[int, str], Awaitable[None]]] = None) -> BroadcastStats:
+        """Deliver to every user with at most `concurrency` requests in flight.
+
+        on_result(user_id, result) is awaited after every delivery, e.g. to persist it.
+        """
+        stats = BroadcastStats()
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def produce():
+            try:
+                if hasattr(user_ids, '__aiter__'):
+                    async for user_id in user_ids:
+                        await queue.put(user_id)
+                else:
+                    for user_id in user_ids:
+                        await queue.put(user_id)
+            finally:
+                for _ in range(self.concurrency):
+                    await queue.put(None)
+
+        async def work():
+            while (user_id := await queue.get()) is not None:
+                result = await self.deliver(user_id, data)
+                stats.add(result)
+                if on_result:
+                    await on_result(user_id, result)
+
+        await asyncio.gather(produce(), *(work() for _ in range(self.concurrency)))
+        return stats
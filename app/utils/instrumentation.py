@@ -0,0 +1,93 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+import structlog
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from bd.cache import cache_stats
+from bd.metrics import Counter, Histogram, register_collector, render
+
+logger = structlog.get_logger(__name__)
+
+UPDATE_SECONDS = Histogram('bot_update_seconds', "Time from the chat's turn to the end of handling, by update type",
+                           ['type'])
+UPDATE_ERRORS = Counter('bot_update_errors_total', 'Updates whose handling raised, by update type', ['type'])
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Time spent in each handler', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Exceptions raised by each handler', ['handler'])
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer update middleware: latency from the chat's turn to the end of handling, and errors"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        update_type = event.event_type
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            UPDATE_ERRORS.inc(type=update_type)
+            raise
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, type=update_type)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware: runs once the handler is chosen, so it is labelled with the handler's name"""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        name = data['handler'].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+
+def setup_metrics(dp: Dispatcher) -> None:
+    """Instrument every update and handler of the dispatcher and its routers.
+
+    Register it before other outer update middlewares, so their time is measured too.
+    """
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    handler_metrics = HandlerMetricsMiddleware()
+    for name, observer in dp.observers.items():
+        # Inner middlewares of the dispatcher also wrap the handlers of included routers
+        if name not in ('update', 'error'):
+            observer.middleware(handler_metrics)
+
+
+def _cache_metrics():
+    """Counters of the bd.cache caches, which keep their own"""
+    hits = Counter('bot_cache_hits_total', 'Lookups answered from a cache', ['cache'], register=False)
+    misses = Counter('bot_cache_misses_total', 'Lookups a cache could not answer', ['cache'], register=False)
+    evictions = Counter('bot_cache_evictions_total', 'Entries pushed out of a full cache', ['cache'], register=False)
+    for name, stats in cache_stats().items():
+        hits.inc(stats['hits'], cache=name)
+        misses.inc(stats['misses'], cache=name)
+        evictions.inc(stats['evictions'], cache=name)
+    return hits, misses, evictions
+
+
+register_collector(_cache_metrics)
+
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serve /metrics in the Prometheus text format, returns the runner to clean up on shutdown"""
+    app = web.Application()
+    app.router.add_get('/metrics', _metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Metrics server started", host=host, port=port)
+    return runner
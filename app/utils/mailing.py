@@ -0,0 +1,129 @@
+import asyncio
+import time
+
+import structlog
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from app.utils.broadcast import Broadcaster, SENT, FAILED, BLOCKED
+from bd.database import get_unfinished_mailing_jobs, get_delivery_counts, iter_user_ids, count_user_ids, \
+    set_delivery_status, set_mailing_progress_message, finish_mailing_job
+
+logger = structlog.get_logger(__name__)
+
+PROGRESS_INTERVAL = 5  # Seconds between edits of the admin's progress message
+IDLE_POLL = 60  # Seconds between checks for new jobs when nobody wakes the worker
+ERROR_DELAY = 30  # Seconds to wait after a job failed unexpectedly
+
+
+def job_recipients(job):
+    """Stream the users of the job's segment, skipping those a previous run already handled"""
+    return iter_user_ids(job['segment_program_id'], bool(job['segment_has_phone']), job['id'])
+
+
+class MailingProgress:
+    """Delivery counters of one job, including those from before a restart"""
+
+    def __init__(self, job_id: int, counts: dict, remaining: int):
+        self.job_id = job_id
+        self.sent = counts.get(SENT, 0)
+        self.failed = counts.get(FAILED, 0)
+        self.blocked = counts.get(BLOCKED, 0)
+        self.remaining = remaining
+        self.started = time.monotonic()
+        self.done_now = 0  # Deliveries handled since this worker picked the job up
+
+    def add(self, result: str) -> None:
+        setattr(self, result, getattr(self, result) + 1)
+        self.remaining = max(self.remaining - 1, 0)  # Users who joined after the count
+        self.done_now += 1
+
+    def eta(self) -> str:
+        elapsed = time.monotonic() - self.started
+        if not self.done_now or not elapsed:
+            return "—"
+        seconds = int(self.remaining / (self.done_now / elapsed))
+        return f"{seconds // 60}:{seconds % 60:02d}"
+
+    def format(self, finished: bool = False) -> str:
+        title = f"Рассылка #{self.job_id} завершена." if finished else f"Рассылка #{self.job_id} идёт..."
+        text = (
+            f"{title}\n"
+            f"Успешно отправлено: {self.sent}\n"
+            f"Не удалось отправить: {self.failed}\n"
+            f"Заблокировали бота: {self.blocked}"
+        )
+        if not finished:
+            text += f"\nОсталось: {self.remaining}\nОсталось времени: {self.eta()}"
+        return text
+
+
+class MailingWorker:
+    """Drains mailing jobs stored in the database, resuming them after a restart"""
+
+    def __init__(self, bot: Bot, broadcaster: Broadcaster):
+        self.bot = bot
+        self.broadcaster = broadcaster
+        self._wake = asyncio.Event()
+
+    def wake(self) -> None:
+        """Tell the worker a new job was stored"""
+        self._wake.set()
+
+    def start(self) -> asyncio.Task:
+        return asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        while True:
+            self._wake.clear()
+            jobs = await get_unfinished_mailing_jobs()
+            for job in jobs:
+                try:
+                    await self.process(job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Mailing job failed", job_id=job['id'], error=str(e))
+                    await asyncio.sleep(ERROR_DELAY)
+            if jobs:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), IDLE_POLL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process(self, job) -> None:
+        job_id = job['id']
+        remaining = await count_user_ids(job['segment_program_id'], bool(job['segment_has_phone']), job_id)
+        progress = MailingProgress(job_id, await get_delivery_counts(job_id), remaining)
+        message_id = job['progress_message_id']
+        if message_id is None:
+            sent = await self.bot.send_message(chat_id=job['admin_id'], text=progress.format())
+            message_id = sent.message_id
+            await set_mailing_progress_message(job_id, message_id)
+
+        async def on_result(user_id: int, result: str) -> None:
+            await set_delivery_status(job_id, user_id, result)
+            progress.add(result)
+
+        data = {"text": job['text'], "photo": job['photo'], "caption": job['caption']}
+        reporter = asyncio.create_task(self._report(job['admin_id'], message_id, progress))
+        try:
+            await self.broadcaster.run(job_recipients(job), data, on_result)
+        finally:
+            reporter.cancel()
+
+        await finish_mailing_job(job_id)
+        await self._edit(job['admin_id'], message_id, progress.format(finished=True))
+
+    async def _report(self, chat_id: int, message_id: int, progress: MailingProgress) -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await self._edit(chat_id, message_id, progress.format())
+
+    async def _edit(self, chat_id: int, message_id: int, text: str) -> None:
+        try:
+            await self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text)
+        except TelegramBadRequest:
+            # Unchanged text or the progress message was deleted
+            pass
@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import os
+from typing import List, Optional, Sequence
+
+import structlog
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto, Message
+
+from bd.database import get_media_file_id, save_media_file_id, delete_media_file_id
+
+logger = structlog.get_logger(__name__)
+
+MEDIA_GROUP_SIZE = 10
+HASH_CHUNK_SIZE = 1 << 16
+# Parts of Telegram's error text when a stored file_id can no longer be used, e.g.
+# "wrong file identifier/HTTP URL specified" or "wrong remote file identifier specified"
+_STALE_FILE_ID_ERRORS = ('file identifier', 'file_id', 'file reference')
+
+# path -> (mtime_ns, size, sha256), so an unchanged file is not read again on every send
+_hashes = {}
+# Uploads happen once per asset, doing them one at a time lets concurrent senders of the
+# same file wait for its file_id instead of uploading it again
+_upload_lock = asyncio.Lock()
+
+
+def is_local_file(photo: Optional[str]) -> bool:
+    """True for a path on disk, False for a Telegram file_id"""
+    return bool(photo) and os.path.isfile(photo)
+
+
+def is_stale_file_id(error: TelegramBadRequest) -> bool:
+    """True when Telegram rejected a file_id, not the chat or the message"""
+    text = error.message.lower()
+    return any(part in text for part in _STALE_FILE_ID_ERRORS)
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def content_hash(path: str) -> str:
+    """sha256 of a file, recomputed only when its mtime or size changes"""
+    stat = os.stat(path)
+    cached = _hashes.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    digest = await asyncio.to_thread(_hash_file, path)
+    _hashes[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+async def _send(bot: Bot, chat_id: int, photos: list, caption: Optional[str]) -> List[Message]:
+    """One photo as a photo, several as media groups of up to ten"""
+    if len(photos) == 1:
+        return [await bot.send_photo(chat_id=chat_id, photo=photos[0], caption=caption)]
+    sent = []
+    for i in range(0, len(photos), MEDIA_GROUP_SIZE):
+        group = [InputMediaPhoto(media=photo) for photo in photos[i:i + MEDIA_GROUP_SIZE]]
+        if i == 0 and caption:
+            group[0].caption = caption
+        sent.extend(await bot.send_media_group(chat_id=chat_id, media=group))
+    return sent
+
+
+async def send_photos(bot: Bot, chat_id: int, paths: Sequence[str], caption: Optional[str] = None) -> List[Message]:
+    """Send local image files, uploading each distinct content only once.
+
+    The file_id Telegram returns for an upload is stored by content hash, so a file
+    whose content changed is uploaded again and an unchanged one never is.
+    """
+    hashes = [await content_hash(path) for path in paths]
+    file_ids = [await get_media_file_id(digest) for digest in hashes]
+    if all(file_ids):
+        try:
+            return await _send(bot, chat_id, file_ids, caption)
+        except TelegramBadRequest as e:
+            # A chat that is gone or blocked says nothing about the file_id, only a stale one is uploaded again
+            if not is_stale_file_id(e):
+                raise
+
+    async with _upload_lock:
+        # Another sender may have uploaded the same files while this one waited
+        file_ids = [await get_media_file_id(digest) for digest in hashes]
+        photos = [file_id or FSInputFile(path=path) for path, file_id in zip(paths, file_ids)]
+        try:
+            sent = await _send(bot, chat_id, photos, caption)
+        except TelegramBadRequest as e:
+            if not any(file_ids) or not is_stale_file_id(e):
+                raise
+            for digest, file_id in zip(hashes, file_ids):
+                if file_id:
+                    await delete_media_file_id(digest)
+            file_ids = [None] * len(paths)
+            sent = await _send(bot, chat_id, [FSInputFile(path=path) for path in paths], caption)
+
+        for digest, path, file_id, message in zip(hashes, paths, file_ids, sent):
+            if file_id is None and message.photo:
+                await save_media_file_id(digest, message.photo[-1].file_id, path)
+                logger.info("Uploaded media", path=path)
+        return sent
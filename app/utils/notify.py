@@ -0,0 +1,31 @@
+import asyncio
+from typing import Dict, Optional
+
+import structlog
+from aiogram import Bot
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from setings import ADMIN_ID
+
+logger = structlog.get_logger(__name__)
+
+
+async def notify_admins(bot: Bot, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                        exclude: Optional[int] = None) -> Dict[int, Message]:
+    """Send one message to every admin at once.
+
+    An admin that cannot be reached is logged and skipped without delaying the others.
+    Returns the sent messages by admin id.
+    """
+    admins = [admin_id for admin_id in ADMIN_ID if admin_id != exclude]
+    results = await asyncio.gather(
+        *(bot.send_message(chat_id=admin_id, text=text, reply_markup=reply_markup) for admin_id in admins),
+        return_exceptions=True
+    )
+    sent = {}
+    for admin_id, result in zip(admins, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to notify admin", admin_id=admin_id, error=str(result))
+        else:
+            sent[admin_id] = result
+    return sent
@@ -0,0 +1,78 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Dict, Tuple
+
+import structlog
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import ErrorEvent
+
+logger = structlog.get_logger(__name__)
+
+
+class ChatQueueFull(Exception):
+    """An update of a chat that already has `max_pending` updates queued"""
+
+    def __init__(self, chat_id: int):
+        super().__init__(f"Chat {chat_id} has too many updates queued")
+        self.chat_id = chat_id
+
+
+class _ChatQueue:
+    __slots__ = ('lock', 'pending')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # FIFO: waiters acquire it in arrival order
+        self.pending = 0
+
+
+class ChatEventIsolation(BaseEventIsolation):
+    """Handles the updates of one chat one at a time in arrival order, different chats in parallel.
+
+    Passed as Dispatcher(events_isolation=...): aiogram takes the lock before it loads the FSM state,
+    so a handler sees the state the previous update of its chat left. At most `concurrency` handlers
+    run at once; an update waiting for its chat does not take one of those slots. A chat with
+    `max_pending` updates already queued gets ChatQueueFull for further ones, see drop_update(), so a
+    flood from one user cannot pile up in memory. Locks of chats with nothing queued are dropped.
+    """
+
+    def __init__(self, concurrency: int, max_pending: int):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._max_pending = max_pending
+        self._chats: Dict[Tuple[int, int], _ChatQueue] = {}
+        self.dropped = 0
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        # The FSM key is per user in a chat, the turn is per chat
+        chat = (key.bot_id, key.chat_id)
+        queue = self._chats.get(chat)
+        if queue is None:
+            queue = self._chats[chat] = _ChatQueue()
+        if queue.pending >= self._max_pending:
+            self.dropped += 1
+            raise ChatQueueFull(key.chat_id)
+
+        queue.pending += 1
+        try:
+            async with queue.lock:
+                async with self._semaphore:
+                    yield
+        finally:
+            queue.pending -= 1
+            if not queue.pending:
+                del self._chats[chat]
+
+    async def close(self) -> None:
+        self._chats.clear()
+
+    @property
+    def chats(self) -> int:
+        """Chats with updates in progress or queued"""
+        return len(self._chats)
+
+
+async def drop_update(event: ErrorEvent) -> bool:
+    """Error handler for ChatQueueFull: the update is dropped with a warning instead of an error log"""
+    logger.warning("Chat queue full, update dropped", chat_id=event.exception.chat_id,
+                   update_id=event.update.update_id)
+    return True
@@ -1,179 +1,468 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import hashlib
+import aiohttp
+import lxml.html
 from PIL import Image, ImageDraw, ImageFont
 import os
 import json
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+
+from app.utils.media import send_photos
+from app.utils.schedule_model import PLACEHOLDER, Schedule
+from bd.metrics import Histogram
+from setings import PHOTO_PATH
 
 # Configuration variables
-FONT_PATH = os.path.join(os.path.dirname(__file__), 'fonts', 'ArialUnicodeMS.ttf')
+FONTS_DIR = os.path.join(os.path.dirname(__file__), 'fonts')
+FONT_PATH = os.path.join(FONTS_DIR, 'ArialUnicodeMS.ttf')
+FALLBACK_FONT_PATH = os.path.join(FONTS_DIR, 'DejaVuSans.ttf')  # Shipped with the repo
 URL = "https://recordfit63.ru/schedule/"
-OUTPUT_IMAGE = "schedule.png"
-CACHE_FILE = "schedule_cache.json"
+OUTPUT_IMAGE = PHOTO_PATH
+CACHE_FILE = "schedule_cache.bin"
+LEGACY_CACHE_FILE = "schedule_cache.json"  # Read once if the binary cache does not exist yet
+RENDER_STATE_FILE = "schedule_render.json"  # Hash of the rendered rows and the image files
 CACHE_DURATION = 3600  # Cache duration in seconds (1 hour)
-
-
-def fetch_html(url):
+FETCH_TIMEOUT = 10  # Seconds
+REFRESH_INTERVAL = CACHE_DURATION  # How often the background refresher fetches the site
+RETRY_DELAY = 60  # First retry after a failed fetch, doubled on every further failure
+MAX_RETRY_DELAY = 1800
+WORKERS = 2  # Threads for parsing, rendering and cache file I/O
+TIMEZONE = timezone(timedelta(hours=4))  # Samara, decides what "today" is
+
+# Image layout
+IMG_WIDTH = 1200
+PADDING = 50
+TITLE_HEIGHT = 60
+LINE_SPACING = 40
+HEADER_GAP = 20
+DAY_GAP = 20
+ROW_GAP = 10
+COLUMNS = [150, 350, 550, 800]
+# Grayscale levels, the image is drawn in 'L' mode and saved with a small palette
+BG_COLOR = 245
+HEADER_COLOR = 30
+TEXT_COLOR = 60
+LINE_COLOR = 200
+PALETTE_COLORS = 16
+# Telegram rejects photos with width + height above 10000 or a side ratio above 20
+MAX_PHOTO_SIDES = 10000
+MAX_PHOTO_RATIO = 20
+
+# fetch, parse and render; parse and render include the wait for a free worker
+STAGE_SECONDS = Histogram('bot_schedule_stage_seconds', 'Time of schedule refresh stages', ['stage'])
+
+# Parsing and rendering are CPU bound, keep them off the event loop
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='schedule')
+# Refresh in progress, shared by every caller that arrives while it runs
+_refresh_task = None
+# Last good schedule, shared by the renderer and schedule queries
+_schedule = None
+
+
+async def run_in_worker(func, *args):
+    """Run a blocking function in the schedule worker pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+async def fetch_html(url):
     """Fetch HTML content from URL with timeout and error handling"""
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.text
-    except requests.Timeout:
+        timeout = aiohttp.ClientTimeout(total=FETCH_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                return await response.text()
+    except asyncio.TimeoutError:
         print("Request timed out")
         return ""
-    except requests.RequestException as e:
+    except aiohttp.ClientError as e:
         print(f"Error fetching HTML: {e}")
         return ""
 
 
-def get_cached_schedule(url, cache_file=CACHE_FILE, cache_duration=CACHE_DURATION):
-    """Get schedule from cache or fetch new data if cache is expired"""
+def load_legacy_cache(cache_file=LEGACY_CACHE_FILE):
+    """Read the JSON cache written by earlier versions"""
     if os.path.exists(cache_file):
         try:
             with open(cache_file, 'r', encoding='utf-8') as f:
                 cache = json.load(f)
-                if datetime.now().timestamp() - cache['timestamp'] < cache_duration:
-                    return cache['data']
-        except (json.JSONDecodeError, KeyError):
+                return Schedule.from_rows(cache['data'], cache['timestamp'])
+        except (json.JSONDecodeError, KeyError, TypeError):
             pass
+    return None
+
+
+def load_cache(cache_file=CACHE_FILE):
+    """Return the cached schedule regardless of age, or None"""
+    schedule = None
+    if os.path.exists(cache_file):
+        try:
+            schedule = Schedule.load(cache_file)
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            print(f"Error loading cache: {e}")
+    else:
+        schedule = load_legacy_cache()
+    return schedule if schedule else None
+
+
+async def current_schedule():
+    """Last good schedule, waiting for the first refresh if there is none yet"""
+    if _schedule is None:
+        await admin_create_schedule()
+    return _schedule
+
+
+def format_lessons(title, lessons, show_date=False):
+    """Short text reply for a handful of lessons"""
+    if not lessons:
+        return f"{title}\n\nЗанятий нет."
+    lines = [title, ""]
+    current_date = None
+    for item in lessons:
+        if show_date and item.date != current_date:
+            current_date = item.date
+            lines.append(f"📅 {current_date}")
+        lines.append(f"🕒 {item.time} — {item.lesson}\n{item.trainer}, {item.room}")
+    return "\n".join(lines)
+
+
+def lessons_on(schedule, days_ahead=0):
+    """Text reply with the lessons of today (0), tomorrow (1), ..."""
+    day = datetime.now(TIMEZONE).date() + timedelta(days=days_ahead)
+    title = {0: "Расписание на сегодня", 1: "Расписание на завтра"}.get(days_ahead, "Расписание")
+    return format_lessons(f"{title}, {day:%d.%m}:", schedule.on(day) if schedule else [])
+
+
+def lessons_of_trainer(schedule, key):
+    """Text reply with the week of one trainer, None for an unknown key"""
+    trainer = schedule.trainers.get(key) if schedule else None
+    if trainer is None:
+        return None
+    return format_lessons(f"Занятия тренера {trainer}:", schedule.by_trainer[trainer], show_date=True)
+
+
+def schedule_hash(schedule):
+    """Stable hash of the extracted schedule rows"""
+    payload = json.dumps(schedule.rows(), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_render_state(state_file=RENDER_STATE_FILE):
+    """Read which schedule the image on disk was rendered from"""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+            # Single image state written by earlier versions
+            return {'hash': state['hash'], 'files': state.get('files', [OUTPUT_IMAGE])}
+    except (OSError, json.JSONDecodeError, KeyError):
+        return {'hash': None, 'files': []}
 
-    html_content = fetch_html(url)
-    schedule = extract_schedule(html_content)
 
+def save_render_state(state, state_file=RENDER_STATE_FILE):
+    """Persist render state so a restart does not re-render"""
     try:
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                'timestamp': datetime.now().timestamp(),
-                'data': schedule
-            }, f, ensure_ascii=False)
+        with open(state_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+    except Exception as e:
+        print(f"Error saving render state: {e}")
+
+
+_render_state = load_render_state()
+
+
+def save_cache(schedule, cache_file=CACHE_FILE):
+    """Write schedule to the cache file"""
+    try:
+        schedule.dump(cache_file)
     except Exception as e:
         print(f"Error saving cache: {e}")
 
-    return schedule
+
+async def update_cache(url, cache_file=CACHE_FILE, cache_duration=CACHE_DURATION):
+    """Fetch new data if the cache is expired. Returns (schedule, fresh).
+
+    A failed fetch never replaces the last good schedule: it is returned with fresh=False.
+    """
+    global _schedule
+    if _schedule is None:
+        _schedule = await run_in_worker(load_cache, cache_file)
+    if _schedule and datetime.now().timestamp() - _schedule.timestamp < cache_duration:
+        return _schedule, True
+
+    with STAGE_SECONDS.time(stage='fetch'):
+        html_content = await fetch_html(url)
+    with STAGE_SECONDS.time(stage='parse'):
+        rows = await run_in_worker(extract_schedule, html_content)
+    if not rows:
+        return _schedule, False
+
+    schedule = Schedule.from_rows(rows, datetime.now().timestamp())
+    await run_in_worker(save_cache, schedule, cache_file)
+    _schedule = schedule
+    return schedule, True
+
+
+async def get_cached_schedule(url, cache_file=CACHE_FILE, cache_duration=CACHE_DURATION):
+    """Get schedule from cache or fetch new data if cache is expired"""
+    schedule, _ = await update_cache(url, cache_file, cache_duration)
+    return schedule if schedule is not None else Schedule(())
+
+
+# Elements whose strings BeautifulSoup leaves out of .text
+_NON_TEXT_TAGS = frozenset(('script', 'style', 'template'))
+# Event field -> (tag, class) of the first descendant holding its value
+_EVENT_FIELDS = (
+    ('time', 'div', 'time'),
+    ('lesson', 'span', 'lesson'),
+    ('trainer', 'span', 'name'),
+    ('room', 'span', 'number'),
+)
+
+
+def _parse_html(html_content):
+    try:
+        return lxml.html.document_fromstring(html_content)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration
+        return lxml.html.document_fromstring(html_content.encode('utf-8'))
+
+
+def _element_text(element, parts):
+    """Collect text the way BeautifulSoup .text does: no comments, scripts or styles"""
+    if element.text and element.tag not in _NON_TEXT_TAGS:
+        parts.append(element.text)
+    if element.tag not in _NON_TEXT_TAGS:
+        for child in element:
+            if isinstance(child.tag, str):
+                _element_text(child, parts)
+            if child.tail:
+                parts.append(child.tail)
+    return parts
+
+
+def _text(element):
+    return ''.join(_element_text(element, [])).strip()
+
+
+def _event_fields(event):
+    """Values of the four event fields, found in one walk over the event subtree"""
+    found = {}
+    for element in event.iterdescendants('div', 'span'):
+        classes = element.get('class')
+        if not classes:
+            continue
+        classes = classes.split()
+        for field, tag, css_class in _EVENT_FIELDS:
+            if field not in found and element.tag == tag and css_class in classes:
+                found[field] = _text(element)
+        if len(found) == len(_EVENT_FIELDS):
+            break
+    return {field: found.get(field, PLACEHOLDER) for field, _, _ in _EVENT_FIELDS}
 
 
 def extract_schedule(html_content):
-    """Extract schedule data from HTML content using optimized selectors"""
+    """Extract schedule data from HTML content in a single lxml pass per day column"""
     if not html_content:
         return []
 
-    soup = BeautifulSoup(html_content, "lxml")
+    root = _parse_html(html_content)
     schedule = []
 
-    days = soup.select("div.col")
-    for day in days:
-        date_div = day.select_one("div.cel.date")
-        if not date_div:
+    for day in root.iter('div'):
+        if 'col' not in day.get('class', '').split():
             continue
 
-        date = date_div.text.strip()
-        events = day.select("div[class*='cel class'], div[class*='ct-']")
-
-        for event in events:
-            if "cel not" in event.get("class", []):
+        date_div = None
+        events = []
+        for element in day.iterdescendants('div'):
+            classes = element.get('class')
+            if not classes:
                 continue
+            classes = classes.split()
+            if date_div is None and 'cel' in classes and 'date' in classes:
+                date_div = element
+            # Same match as the former div[class*='cel class'], div[class*='ct-'] selector
+            joined = ' '.join(classes)
+            if 'cel class' in joined or 'ct-' in joined:
+                events.append(element)
+
+        if date_div is None:
+            continue
 
-            schedule.append({
-                "date": date,
-                "time": event.select_one("div.time").text.strip() if event.select_one("div.time") else "N/A",
-                "lesson": event.select_one("span.lesson").text.strip() if event.select_one("span.lesson") else "N/A",
-                "trainer": event.select_one("span.name").text.strip() if event.select_one("span.name") else "N/A",
-                "room": event.select_one("span.number").text.strip() if event.select_one("span.number") else "N/A",
-            })
+        date = _text(date_div)
+        for event in events:
+            schedule.append({"date": date, **_event_fields(event)})
 
     return schedule
 
 
-def create_image(schedule, output_file):
-    """Generate image with schedule using optimized drawing"""
-    try:
-        # Cache fonts
-        fonts = {
-            'regular': ImageFont.truetype(FONT_PATH, 18),
-            'header': ImageFont.truetype(FONT_PATH, 22),
-            'title': ImageFont.truetype(FONT_PATH, 28)
-        }
-
-        # Calculate dynamic image dimensions
-        entries_count = len(schedule)
-        estimated_height = 200 + (entries_count * 50)  # Base height + entries
-        img_height = min(max(estimated_height, 800), 10000)  # Dynamic height with limits
-        img_width = 1200
-
-        # Image settings
-        padding = 50
-        line_spacing = 40
-        column_spacing = [150, 350, 550, 800]
-
-        # Colors
-        bg_color = (245, 245, 245)
-        header_color = (30, 30, 30)
-        text_color = (60, 60, 60)
-        line_color = (200, 200, 200)
-
-        # Create image
-        img = Image.new('RGB', (img_width, 2000), color=bg_color)
-        draw = ImageDraw.Draw(img)
-
-        # Initial coordinates
-        x, y = padding, padding
-
-        # Add title
-        draw.text((x, y), "Расписание тренировок на неделю", font=fonts['title'], fill=header_color)
-        y += 60
-
-        # Column headers
-        headers = ["Время", "Занятие", "Тренер", "Кабинет"]
-        for i, header in enumerate(headers):
-            draw.text((x + column_spacing[i], y), header, font=fonts['header'], fill=header_color)
-        y += line_spacing
-
-        # Header underline
-        draw.line((padding, y, img_width - padding, y), fill=line_color, width=2)
-        y += 20
-
-        current_date = None
-        for item in schedule:
-            # Date display
-            if item['date'] != current_date:
-                current_date = item['date']
-                y += 20
-                draw.text((x, y), f"Дата: {current_date}", font=fonts['header'], fill=header_color)
-                y += line_spacing
+@lru_cache(maxsize=None)
+def get_font(size):
+    """Fonts are loaded once per process"""
+    path = FONT_PATH if os.path.exists(FONT_PATH) else FALLBACK_FONT_PATH
+    return ImageFont.truetype(path, size)
 
+
+def layout_height(days):
+    """Exact height of a page listing the given days"""
+    height = PADDING + TITLE_HEIGHT + LINE_SPACING + HEADER_GAP
+    for lessons in days.values():
+        height += DAY_GAP + LINE_SPACING + len(lessons) * (LINE_SPACING + ROW_GAP)
+    return height + PADDING
+
+
+def fits_telegram(height):
+    return IMG_WIDTH + height <= MAX_PHOTO_SIDES and height <= IMG_WIDTH * MAX_PHOTO_RATIO
+
+
+def draw_page(title, days):
+    """Draw one page sized to its content"""
+    img = Image.new('L', (IMG_WIDTH, layout_height(days)), color=BG_COLOR)
+    draw = ImageDraw.Draw(img)
+
+    # Initial coordinates
+    x, y = PADDING, PADDING
+
+    # Add title
+    draw.text((x, y), title, font=get_font(28), fill=HEADER_COLOR)
+    y += TITLE_HEIGHT
+
+    # Column headers
+    headers = ["Время", "Занятие", "Тренер", "Кабинет"]
+    for i, header in enumerate(headers):
+        draw.text((x + COLUMNS[i], y), header, font=get_font(22), fill=HEADER_COLOR)
+    y += LINE_SPACING
+
+    # Header underline
+    draw.line((PADDING, y, IMG_WIDTH - PADDING, y), fill=LINE_COLOR, width=2)
+    y += HEADER_GAP
+
+    for date, lessons in days.items():
+        # Date display
+        y += DAY_GAP
+        draw.text((x, y), f"Дата: {date}", font=get_font(22), fill=HEADER_COLOR)
+        y += LINE_SPACING
+
+        for item in lessons:
             # Data display
-            values = [item['time'], item['lesson'], item['trainer'], item['room']]
+            values = [item.time, item.lesson, item.trainer, item.room]
             for i, value in enumerate(values):
-                draw.text((x + column_spacing[i], y), value, font=fonts['regular'], fill=text_color)
-            y += line_spacing
+                draw.text((x + COLUMNS[i], y), value, font=get_font(18), fill=TEXT_COLOR)
+            y += LINE_SPACING
 
             # Separator line
-            draw.line((padding, y, img_width - padding, y), fill=line_color, width=1)
-            y += 10
+            draw.line((PADDING, y, IMG_WIDTH - PADDING, y), fill=LINE_COLOR, width=1)
+            y += ROW_GAP
+
+    return img
 
 
+def save_page(img, output_file):
+    img.quantize(colors=PALETTE_COLORS).save(output_file, optimize=True)
 
-        img.save(output_file)
-        print(f"Image saved to: {output_file}")
+
+def create_image(schedule, output_file):
+    """Render the schedule, returns the written files or an empty list on error.
+
+    The week goes into one image while it fits Telegram's photo limits,
+    otherwise every day becomes its own tile (output_file with a _<n> suffix).
+    """
+    try:
+        if fits_telegram(layout_height(schedule.days)):
+            save_page(draw_page("Расписание тренировок на неделю", schedule.days), output_file)
+            files = [output_file]
+        else:
+            base, ext = os.path.splitext(output_file)
+            files = []
+            for n, (date, lessons) in enumerate(schedule.days.items(), start=1):
+                tile_file = f"{base}_{n}{ext}"
+                save_page(draw_page(f"Расписание тренировок: {date}", {date: lessons}), tile_file)
+                files.append(tile_file)
+        print(f"Image saved to: {', '.join(files)}")
+        return files
     except Exception as e:
         print(f"Error creating image: {e}")
+        return []
 
 
-def main():
-    """Main execution function with error handling"""
+async def refresh_schedule(cache_duration=CACHE_DURATION):
+    """Fetch, parse and render the schedule without blocking the event loop.
+
+    Returns False when the site could not be fetched, the last good schedule stays in place.
+    """
     try:
         # Get schedule with caching
-        schedule = get_cached_schedule(URL)
+        schedule, fresh = await update_cache(URL, cache_duration=cache_duration)
+        if not fresh:
+            print("Failed to retrieve schedule data")
 
         if schedule:
-            create_image(schedule, OUTPUT_IMAGE)
-        else:
-            print("Failed to retrieve schedule data")
+            content_hash = schedule_hash(schedule)
+            if content_hash == _render_state['hash'] and rendered_files():
+                return fresh
+            with STAGE_SECONDS.time(stage='render'):
+                files = await run_in_worker(create_image, schedule, OUTPUT_IMAGE)
+            if files:
+                _render_state.update(hash=content_hash, files=files)
+                await run_in_worker(save_render_state, dict(_render_state))
+        return fresh
 
     except Exception as e:
         print(f"An error occurred: {e}")
+        return False
+
+
+async def admin_create_schedule(cache_duration=CACHE_DURATION):
+    """Refresh the schedule image, joining a refresh that is already running"""
+    global _refresh_task
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(refresh_schedule(cache_duration))
+    # Shield so that one cancelled caller does not cancel the refresh for the others
+    return await asyncio.shield(_refresh_task)
+
+
+async def schedule_refresher(interval=REFRESH_INTERVAL):
+    """Keep schedule and image fresh in the background, backing off while the site is down"""
+    delay = RETRY_DELAY
+    while True:
+        if await admin_create_schedule(cache_duration=interval):
+            delay = RETRY_DELAY
+            age = datetime.now().timestamp() - _schedule.timestamp
+            await asyncio.sleep(max(interval - age, 1))
+        else:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+
+def start_schedule_refresher(interval=REFRESH_INTERVAL):
+    """Start the background refresher, returns its task"""
+    return asyncio.create_task(schedule_refresher(interval))
+
+
+def rendered_files():
+    """Image files of the current rendering, empty if any of them is missing"""
+    files = _render_state['files']
+    return files if files and all(os.path.exists(path) for path in files) else []
+
+
+async def send_schedule(message):
+    """Answer with the schedule image(s), each rendered version is uploaded only once"""
+    if not rendered_files():
+        # Nothing to serve yet, the user has to wait for the first render
+        await admin_create_schedule()
+    files = rendered_files()
+    if not files:
+        return await message.answer("Расписание сейчас недоступно, попробуйте позже.")
+    return await send_photos(message.bot, message.chat.id, files)
+
+
+def main():
+    """Main execution function with error handling"""
+    asyncio.run(refresh_schedule())
 
 
-async def admin_create_schedule():
-    main()
\ No newline at end of file
+if __name__ == '__main__':
+    main()
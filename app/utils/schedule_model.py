@@ -0,0 +1,106 @@
+import marshal
+import sys
+import zlib
+from array import array
+
+FORMAT_VERSION = 1
+FIELDS = ('date', 'time', 'lesson', 'trainer', 'room')
+PLACEHOLDER = "N/A"  # Value of a field the site left out, e.g. a lesson without a trainer
+
+
+def day_key(date_text):
+    """'Пн  02.12' -> '02.12', the part of a schedule date that identifies the day"""
+    return date_text.split()[-1] if date_text.strip() else date_text
+
+
+def trainer_key(trainer):
+    """Short stable id of a trainer, small enough for callback data"""
+    return format(zlib.crc32(trainer.encode('utf-8')), '08x')
+
+
+class Lesson:
+    """One row of the schedule, strings are interned so repeated values are shared"""
+    __slots__ = FIELDS
+
+    def __init__(self, date, time, lesson, trainer, room):
+        self.date = sys.intern(date)
+        self.time = sys.intern(time)
+        self.lesson = sys.intern(lesson)
+        self.trainer = sys.intern(trainer)
+        self.room = sys.intern(room)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def __repr__(self):
+        return f"Lesson({self.date!r}, {self.time!r}, {self.lesson!r}, {self.trainer!r}, {self.room!r})"
+
+
+class Schedule:
+    """Weekly schedule grouped by day and indexed by trainer and lesson"""
+    __slots__ = ('timestamp', 'lessons', 'days', 'by_day', 'by_trainer', 'by_lesson', 'trainers')
+
+    def __init__(self, lessons, timestamp=0.0):
+        self.timestamp = timestamp
+        self.lessons = tuple(lessons)
+        self.days = {}
+        self.by_day = {}
+        self.by_trainer = {}
+        self.by_lesson = {}
+        for item in self.lessons:
+            self.days.setdefault(item.date, []).append(item)
+            self.by_day.setdefault(day_key(item.date), []).append(item)
+            if item.trainer and item.trainer != PLACEHOLDER:
+                self.by_trainer.setdefault(item.trainer, []).append(item)
+            self.by_lesson.setdefault(item.lesson, []).append(item)
+        self.trainers = {trainer_key(trainer): trainer for trainer in sorted(self.by_trainer)}
+
+    @classmethod
+    def from_rows(cls, rows, timestamp=0.0):
+        """Build from the dicts returned by extract_schedule()"""
+        return cls((Lesson(**row) for row in rows), timestamp)
+
+    def on(self, day):
+        """Lessons on a calendar date"""
+        return self.by_day.get(day.strftime('%d.%m'), [])
+
+    def rows(self):
+        return [item.as_dict() for item in self.lessons]
+
+    def __len__(self):
+        return len(self.lessons)
+
+    def __iter__(self):
+        return iter(self.lessons)
+
+    def dumps(self):
+        """Columnar encoding: a table of distinct strings plus one index column per field"""
+        strings = {}
+        columns = []
+        for field in FIELDS:
+            column = array('I', (strings.setdefault(getattr(item, field), len(strings)) for item in self.lessons))
+            columns.append(column.tobytes())
+        return marshal.dumps((FORMAT_VERSION, self.timestamp, tuple(strings), tuple(columns)))
+
+    @classmethod
+    def loads(cls, payload):
+        version, timestamp, strings, columns = marshal.loads(payload)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported schedule cache version {version}")
+        strings = [sys.intern(value) for value in strings]
+        indexes = []
+        for column in columns:
+            values = array('I')
+            values.frombytes(column)
+            indexes.append(values)
+        lessons = (Lesson(*(strings[i] for i in row)) for row in zip(*indexes))
+        return cls(lessons, timestamp)
+
+    def dump(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.dumps())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.loads(f.read())
@@ -0,0 +1,46 @@
+from typing import Optional, Tuple
+
+from bd.cache import MISSING, TTLCache
+from bd.database import create_ticket, close_ticket, get_latest_ticket
+
+CACHE_SIZE = 10000  # Users whose active ticket is kept in memory
+
+
+class ActiveTickets:
+    """Latest ticket of every user, read from the tickets table through a bounded LRU cache.
+
+    The tickets table is the source of truth, so active tickets survive a restart and the
+    cache is refilled on demand. Every change goes through open() and close(), which keep
+    the cache in step with the table.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        # user_id -> (ticket_id, is_open) or None, no TTL since every change invalidates
+        self._cache = TTLCache('active_tickets', maxsize=maxsize)
+
+    async def get(self, user_id: int) -> Optional[Tuple[int, bool]]:
+        """(ticket_id, is_open) of the user's latest ticket, None if they never asked"""
+        entry = self._cache.get(user_id)
+        if entry is MISSING:
+            generation = self._cache.generation(user_id)
+            entry = await get_latest_ticket(user_id)
+            self._cache.set(user_id, entry, generation)
+        return entry
+
+    async def open(self, user_id: int) -> Optional[int]:
+        """Create a ticket, it becomes the user's active one"""
+        ticket_id = await create_ticket(user_id)
+        if ticket_id:
+            self._cache.set(user_id, (ticket_id, True))
+        return ticket_id
+
+    async def close(self, ticket_id: int, user_id: Optional[int]) -> bool:
+        """Close a ticket from any path, the owner's cached entry is dropped"""
+        if not await close_ticket(ticket_id):
+            return False
+        if user_id is not None:
+            self._cache.invalidate(user_id)
+        return True
+
+
+active_tickets = ActiveTickets()
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+import structlog
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = structlog.get_logger(__name__)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Answers Telegram at once and handles updates in the background, at most `concurrency` at a time"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency: int, secret_token: Optional[str] = None,
+                 **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            await super()._background_feed_update(bot, update)
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher, path: str, concurrency: int,
+                       secret_token: Optional[str] = None) -> web.Application:
+    """aiohttp application that feeds updates posted to `path` into the dispatcher"""
+    app = web.Application()
+    BoundedRequestHandler(dp, bot, concurrency, secret_token=secret_token).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, host: str, port: int, path: str, concurrency: int,
+                      base_url: Optional[str] = None, secret_token: Optional[str] = None) -> None:
+    """Serve updates until cancelled, registering the webhook with Telegram if base_url is set"""
+    runner = web.AppRunner(create_webhook_app(bot, dp, path, concurrency, secret_token))
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        if base_url:
+            await bot.set_webhook(url=base_url.rstrip('/') + path, secret_token=secret_token,
+                                  allowed_updates=dp.resolve_used_update_types())
+        logger.info("Webhook server started", host=host, port=port, path=path)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
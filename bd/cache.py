@@ -0,0 +1,119 @@
+import inspect
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after `ttl` seconds (never if ttl is None)"""
+
+    def __init__(self, name: str, maxsize: int, ttl: Optional[float] = None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Bumped per key by every write or invalidation of it, a read that started before must not
+        # store its result. clear() bumps the epoch, which covers every key at once.
+        self._epoch = 0
+        self._generations: Dict[Hashable, int] = {}
+        _registry[name] = self
+
+    def generation(self, key: Hashable) -> Tuple[int, int]:
+        """Token to pass to set() after reading the value of `key` from its source"""
+        return self._epoch, self._generations.get(key, 0)
+
+    def _bump(self, key: Hashable) -> None:
+        if key not in self._generations and len(self._generations) >= self.maxsize:
+            # Bounded like the entries: forgetting the counters must discard every pending read
+            self._generations.clear()
+            self._epoch += 1
+        self._generations[key] = self._generations.get(key, 0) + 1
+
+    def get(self, key: Hashable) -> Any:
+        """Cached value or MISSING"""
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return MISSING
+
+    def set(self, key: Hashable, value: Any, generation: Optional[Tuple[int, int]] = None) -> None:
+        """Store a value read from the source, skipped if the key changed since `generation` was taken.
+
+        Without a generation the value is a write, it wins over reads of the key still in flight.
+        """
+        if generation is None:
+            self._bump(key)
+        elif generation != self.generation(key):
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._bump(key)
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._epoch += 1
+        self._generations.clear()
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+
+_registry: Dict[str, TTLCache] = {}
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters of every cache by name"""
+    return {name: cache.stats() for name, cache in _registry.items()}
+
+
+def cached(cache: TTLCache, namespace: str):
+    """Cache a coroutine function in `cache` under (namespace, *arguments).
+
+    None is not cached, it is also what the database functions return on errors.
+    wrapper.invalidate(*args) drops the entry of one set of arguments.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def make_key(*args, **kwargs):
+            return (namespace, *signature.bind(*args, **kwargs).arguments.values())
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = make_key(*args, **kwargs)
+            value = cache.get(key)
+            if value is not MISSING:
+                return value
+            generation = cache.generation(key)
+            value = await func(*args, **kwargs)
+            if value is not None:
+                cache.set(key, value, generation)
+            return value
+
+        wrapper.invalidate = lambda *args, **kwargs: cache.invalidate(make_key(*args, **kwargs))
+        return wrapper
+
+    return decorator
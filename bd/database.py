@@ -1,8 +1,16 @@
+import asyncio
+import inspect
 import sqlite3
-from contextlib import contextmanager
-from typing import Optional, List, Tuple, Any
+from contextlib import asynccontextmanager
+from itertools import groupby
+from typing import Optional, List, Tuple, Any, AsyncIterator
 import logging
-from functools import lru_cache
+
+import aiosqlite
+
+from bd.cache import TTLCache, cached
+from bd.metrics import Counter, Histogram, instrument
+from bd.profiler import QueryProfiler, QueryStats
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -11,42 +19,255 @@ logger = logging.getLogger(__name__)
 # Database configuration
 DB_PATH = 'users.db'
 CACHE_TIMEOUT = 300  # 5 minutes
-
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections"""
-    conn = None
+USER_CACHE_SIZE = 10000  # Cached lookups of all kinds together
+POOL_SIZE = 4  # Long-lived connections shared by all handlers
+RECIPIENTS_PAGE_SIZE = 500  # Users read at once when streaming mailing recipients
+BUSY_TIMEOUT = 5  # Seconds to wait for a write lock held by another connection
+STATEMENT_CACHE_SIZE = 128  # Prepared statements kept per connection
+WRITE_BATCH_DELAY = 0.005  # Seconds a write-behind batch collects writes before it commits
+WRITE_BATCH_SIZE = 100  # Writes that commit a batch without waiting for the delay
+
+_pool: Optional[asyncio.Queue] = None
+_pool_lock = asyncio.Lock()
+_writer: Optional['WriteBehind'] = None
+_profiler: Optional[QueryProfiler] = None
+
+
+# Per-user lookups on the handler hot path, dropped by every write to the user's row
+user_cache = TTLCache('users', maxsize=USER_CACHE_SIZE, ttl=CACHE_TIMEOUT)
+# Admin views of open questions, dropped by every new question or answer
+question_cache = TTLCache('questions', maxsize=1, ttl=CACHE_TIMEOUT)
+
+
+def _invalidate_user(user_id: int) -> None:
+    for lookup in (get_phone_number, get_program, get_user_data):
+        lookup.invalidate(user_id)
+
+
+async def _open_connection() -> aiosqlite.Connection:
+    """Open a pooled connection in WAL mode with a prepared statement cache"""
+    kwargs = {'factory': _profiler.connection_factory()} if _profiler is not None else {}
+    conn = await aiosqlite.connect(DB_PATH, timeout=BUSY_TIMEOUT, cached_statements=STATEMENT_CACHE_SIZE, **kwargs)
+    conn.row_factory = sqlite3.Row  # Enable row factory for named columns
+    await conn.execute('PRAGMA journal_mode=WAL')
+    await conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+async def init_pool(size: int = POOL_SIZE) -> None:
+    """Open the connection pool if it is not open yet"""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            return
+        pool = asyncio.Queue()
+        for _ in range(size):
+            pool.put_nowait(await _open_connection())
+        _pool = pool
+
+
+async def close_pool() -> None:
+    """Close every pooled connection"""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            return
+        pool, _pool = _pool, None
+        while not pool.empty():
+            conn = pool.get_nowait()
+            await conn.close()
+
+
+@asynccontextmanager
+async def get_db_connection():
+    """Borrow a connection from the pool for the duration of the block"""
+    if _pool is None:
+        await init_pool()
+    pool = _pool
+    conn = await pool.get()
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row  # Enable row factory for named columns
         yield conn
     except sqlite3.Error as e:
         logger.error(f"Database connection error: {e}")
         raise
     finally:
-        if conn:
-            conn.close()
-
-def init_db():
-    """Initialize database tables"""
+        try:
+            # A block that failed or was cancelled between a write and its commit must not leave
+            # the write to the next borrower's commit. aiosqlite runs the rollback before any later
+            # statement on this connection, even if this await is cancelled too.
+            if conn.in_transaction:
+                await conn.rollback()
+        except sqlite3.Error as e:
+            logger.error(f"Error rolling back a pooled connection: {e}")
+        finally:
+            pool.put_nowait(conn)
+
+class WriteBehind:
+    """Groups writes from many handlers into one transaction per batch.
+
+    A batch is committed WRITE_BATCH_DELAY after its first write or as soon as it holds
+    WRITE_BATCH_SIZE writes. Every write runs in its own savepoint, so a failing statement
+    only fails its caller, and submit() returns after the commit: the calling handler
+    reads its own write.
+    """
+
+    def __init__(self, delay: float = WRITE_BATCH_DELAY, max_rows: int = WRITE_BATCH_SIZE):
+        self.delay = delay
+        self.max_rows = max_rows
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, sql: str, params: tuple = ()) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((sql, params, future))
+        if self._queue.qsize() >= self.max_rows - 1:
+            self._full.set()
+        await future
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.max_rows - 1:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.delay)
+                except asyncio.TimeoutError:
+                    pass
+            self._full.clear()
+            while len(batch) < self.max_rows and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._flush(batch)
+
+    async def _flush(self, batch: list) -> None:
+        errors = {}
+        try:
+            async with get_db_connection() as conn:
+                await conn.execute('BEGIN')
+                # Runs of the same statement go in one executemany, one by one only if it fails
+                for sql, group in groupby(enumerate(batch), key=lambda item: item[1][0]):
+                    group = list(group)
+                    await conn.execute('SAVEPOINT write_behind')
+                    try:
+                        await conn.executemany(sql, [params for _, (_, params, _) in group])
+                    except sqlite3.Error:
+                        await conn.execute('ROLLBACK TO write_behind')
+                        for i, (_, params, _) in group:
+                            await conn.execute('SAVEPOINT write_behind_row')
+                            try:
+                                await conn.execute(sql, params)
+                            except sqlite3.Error as e:
+                                await conn.execute('ROLLBACK TO write_behind_row')
+                                errors[i] = e
+                            await conn.execute('RELEASE write_behind_row')
+                    await conn.execute('RELEASE write_behind')
+                await conn.commit()
+        except sqlite3.Error as e:
+            errors = dict.fromkeys(range(len(batch)), e)
+        for i, (_, _, future) in enumerate(batch):
+            if future.done():
+                continue  # The caller was cancelled
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(None)
+
+    async def close(self) -> None:
+        """Commit what is queued and stop"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._flush(batch)
+
+
+async def _write(sql: str, params: tuple = ()) -> None:
+    """Execute one write, through the write-behind batch when it is enabled"""
+    if _writer is not None:
+        await _writer.submit(sql, params)
+        return
+    async with get_db_connection() as conn:
+        await conn.execute(sql, params)
+        await conn.commit()
+
+async def _add_column_if_missing(conn, table: str, column: str, definition: str):
+    """Bring tables created by earlier versions up to date"""
+    async with conn.execute(f'PRAGMA table_info({table})') as cursor:
+        columns = [row['name'] for row in await cursor.fetchall()]
+    if column not in columns:
+        await conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+# Telegram message ids are unique only within one chat, so a message is identified by (user_id, message_id)
+_TICKET_MESSAGES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS ticket_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ticket_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        message_id INTEGER NOT NULL,
+        question TEXT,
+        answer TEXT,
+        answer_created_at TIMESTAMP,
+        admin_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, message_id)
+    )
+'''
+_TICKET_MESSAGES_COLUMNS = ('id, ticket_id, user_id, message, message_id, question, answer, answer_created_at, '
+                            'admin_id, created_at')
+
+async def _scope_message_ids_to_user(conn):
+    """Rebuild a ticket_messages table whose message_id is UNIQUE across all chats.
+
+    With that constraint the question of a second user with the same message id was never stored.
+    """
+    async with conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'ticket_messages'") as cursor:
+        table_sql = (await cursor.fetchone())[0]
+    if 'message_id INTEGER UNIQUE' not in table_sql:
+        return
+    await conn.execute('BEGIN')
+    await conn.execute('ALTER TABLE ticket_messages RENAME TO ticket_messages_old')
+    await conn.execute(_TICKET_MESSAGES_TABLE)
+    await conn.execute(f'INSERT INTO ticket_messages ({_TICKET_MESSAGES_COLUMNS}) '
+                       f'SELECT {_TICKET_MESSAGES_COLUMNS} FROM ticket_messages_old')
+    await conn.execute('DROP TABLE ticket_messages_old')
+    await conn.commit()
+
+async def init_db(write_behind: bool = False, profile_threshold: Optional[float] = None):
+    """Initialize database tables, write_behind batches the writes of ticket messages and /start.
+
+    profile_threshold (seconds) turns on the query profiler, see slow_queries().
+    """
+    global _writer, _profiler
+    if profile_threshold is not None and _pool is None:
+        _profiler = QueryProfiler(profile_threshold)
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-
+        async with get_db_connection() as conn:
             # Create users table
-            cursor.execute('''
+            await conn.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     id INTEGER PRIMARY KEY,
                     user_id INTEGER UNIQUE,
                     phone_number TEXT,
                     first_name TEXT,
-                    program TEXT,
-                    username TEXT
+                    program_id INTEGER,
+                    username TEXT,
+                    is_blocked INTEGER NOT NULL DEFAULT 0
                 )
             ''')
+            await _add_column_if_missing(conn, 'users', 'is_blocked', 'INTEGER NOT NULL DEFAULT 0')
+            await _add_column_if_missing(conn, 'users', 'program_id', 'INTEGER')
 
             # Create tickets table
-            cursor.execute('''
+            await conn.execute('''
                 CREATE TABLE IF NOT EXISTS tickets (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
@@ -56,338 +277,674 @@ def init_db():
             ''')
 
             # Create ticket_messages table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ticket_messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+            await conn.execute(_TICKET_MESSAGES_TABLE)
+            await _scope_message_ids_to_user(conn)
+
+            # Create admin_messages table: which ticket message every admin notification was sent for
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS admin_messages (
+                    admin_chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
                     ticket_id INTEGER NOT NULL,
                     user_id INTEGER NOT NULL,
-                    message TEXT NOT NULL,
-                    message_id INTEGER UNIQUE NOT NULL,
-                    question TEXT,
-                    answer TEXT,
-                    answer_created_at TIMESTAMP,
-                    admin_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    user_message_id INTEGER NOT NULL,
+                    PRIMARY KEY (admin_chat_id, message_id)
+                ) WITHOUT ROWID
+            ''')
+
+            # Create fsm_states table: aiogram FSM state and data of every chat, see bd/fsm_storage.py
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}'
+                ) WITHOUT ROWID
+            ''')
+
+            # Create mailing tables: one row per job and one per recipient of the job
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS mailing_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    admin_id INTEGER NOT NULL,
+                    text TEXT,
+                    photo TEXT,
+                    caption TEXT,
+                    segment_program_id INTEGER,
+                    segment_has_phone INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    progress_message_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    finished_at TIMESTAMP
                 )
             ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS mailing_deliveries (
+                    job_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    updated_at TIMESTAMP,
+                    PRIMARY KEY (job_id, user_id)
+                ) WITHOUT ROWID
+            ''')
+            # Create media registry: Telegram file_id of every uploaded file, keyed by its content
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS media_files (
+                    content_hash TEXT PRIMARY KEY,
+                    file_id TEXT NOT NULL,
+                    path TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID
+            ''')
 
             # Add indexes for better query performance
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON users(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_tickets_user_id ON tickets(user_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket_id ON ticket_messages(ticket_id)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_ticket_messages_message_id ON ticket_messages(message_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON users(user_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_users_program_id ON users(program_id, user_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_tickets_user_id ON tickets(user_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket_id ON ticket_messages(ticket_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_ticket_messages_message_id ON ticket_messages(message_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_mailing_jobs_status ON mailing_jobs(status)')
+            await conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_mailing_deliveries_status ON mailing_deliveries(job_id, status, user_id)')
 
 
-            conn.commit()
+            await conn.commit()
     except sqlite3.Error as e:
         logger.error(f"Database initialization error: {e}")
         raise
-
-def save_question(user_id: int, question: str, message_id: int, ticket_id: int) -> bool:
+    if write_behind and _writer is None:
+        _writer = WriteBehind()
+        _writer.start()
+
+async def close_db():
+    """Release database resources on shutdown"""
+    global _writer, _profiler
+    if _writer is not None:
+        writer, _writer = _writer, None
+        await writer.close()
+    await close_pool()
+    _profiler = None
+
+async def save_question(user_id: int, question: str, message_id: int, ticket_id: int) -> bool:
     """Save a new question to the database with message_id and ticket_id"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO ticket_messages (user_id, message, message_id, question, ticket_id)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, question, message_id, question, ticket_id))
-            conn.commit()
-            return True
+        await _write('''
+            INSERT INTO ticket_messages (user_id, message, message_id, question, ticket_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, question, message_id, question, ticket_id))
+        question_cache.clear()
+        return True
     except sqlite3.Error as e:
         logger.error(f"Error saving question: {e}")
         return False
 
-def save_ticket_message(ticket_id: int, user_id: int, message: str, message_id: int, is_question: bool = False) -> bool:
+async def save_ticket_message(ticket_id: int, user_id: int, message: str, message_id: int, is_question: bool = False) -> bool:
     """Save a message to a ticket"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            if is_question:
-                cursor.execute('''
-                    INSERT INTO ticket_messages (ticket_id, user_id, message, message_id, question)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (ticket_id, user_id, message, message_id, message))
-            else:
-                cursor.execute('''
-                    INSERT INTO ticket_messages (ticket_id, user_id, message, message_id)
-                    VALUES (?, ?, ?, ?)
-                ''', (ticket_id, user_id, message, message_id))
-            conn.commit()
-            return True
+        if is_question:
+            await _write('''
+                INSERT INTO ticket_messages (ticket_id, user_id, message, message_id, question)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (ticket_id, user_id, message, message_id, message))
+        else:
+            await _write('''
+                INSERT INTO ticket_messages (ticket_id, user_id, message, message_id)
+                VALUES (?, ?, ?, ?)
+            ''', (ticket_id, user_id, message, message_id))
+        question_cache.clear()
+        return True
     except sqlite3.Error as e:
         logger.error(f"Error saving ticket message: {e}")
         return False
 
-def get_question_and_username_by_message_id(message_id: int) -> Optional[Tuple[str, str]]:
+async def get_question_and_username_by_message_id(message_id: int) -> Optional[Tuple[str, str]]:
     """Get the question text and username by message_id"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+        async with get_db_connection() as conn:
+            async with conn.execute('''
                 SELECT tm.question, u.username
                 FROM ticket_messages tm
                 JOIN users u ON tm.user_id = u.user_id
                 WHERE tm.message_id = ?
-            ''', (message_id,))
-            result = cursor.fetchone()
-            return (result[0], result[1]) if result else (None, None)
+            ''', (message_id,)) as cursor:
+                result = await cursor.fetchone()
+                return (result[0], result[1]) if result else (None, None)
     except sqlite3.Error as e:
         logger.error(f"Error fetching question and username: {e}")
         return None, None
 
-@lru_cache(maxsize=100)
-def get_unanswered_questions() -> List[Tuple]:
+@cached(question_cache, 'unanswered')
+async def get_unanswered_questions() -> List[Tuple]:
     """Get all unanswered questions with caching"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM ticket_messages WHERE answer IS NULL')
-            return cursor.fetchall()
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT * FROM ticket_messages WHERE answer IS NULL') as cursor:
+                return await cursor.fetchall()
     except sqlite3.Error as e:
         logger.error(f"Error fetching unanswered questions: {e}")
         return []
 
-def get_question_by_message_id(message_id: int) -> Optional[str]:
+async def get_question_by_message_id(message_id: int) -> Optional[str]:
     """Get the question text by message_id"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT question FROM ticket_messages WHERE message_id = ?', (message_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT question FROM ticket_messages WHERE message_id = ?', (message_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
     except sqlite3.Error as e:
         logger.error(f"Error fetching question: {e}")
         return None
 
-def get_user_id_by_question_id(message_id: int) -> Optional[int]:
+async def get_user_id_by_question_id(message_id: int) -> Optional[int]:
     """Get user_id associated with a question by message_id"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT user_id FROM ticket_messages WHERE message_id = ?', (message_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT user_id FROM ticket_messages WHERE message_id = ?', (message_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
     except sqlite3.Error as e:
         logger.error(f"Error fetching user_id for question: {e}")
         return None
 
-def save_answer(question_id: int, answer: str, admin_id: int) -> bool:
-    """Save an answer to a question"""
+async def save_answer(ticket_id: int, user_id: int, message_id: int, answer: str, admin_id: int) -> bool:
+    """Save an answer to the user's message message_id in a ticket"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+        async with get_db_connection() as conn:
+            await conn.execute('''
                 UPDATE ticket_messages
                 SET answer = ?, answer_created_at = CURRENT_TIMESTAMP, admin_id = ?
-                WHERE message_id = ?
-            ''', (answer, admin_id, question_id))
-            conn.commit()
+                WHERE ticket_id = ? AND user_id = ? AND message_id = ?
+            ''', (answer, admin_id, ticket_id, user_id, message_id))
+            await conn.commit()
+            question_cache.clear()
             return True
     except sqlite3.Error as e:
         logger.error(f"Error saving answer: {e}")
         return False
 
-def add_user_if_not_exists(user_id: int) -> bool:
+async def add_user_if_not_exists(user_id: int) -> bool:
     """Add a new user if they don't exist"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
-            conn.commit()
-            return True
+        # A user who blocked the bot and pressed /start again can receive mailings again
+        await _write('''
+            INSERT INTO users (user_id) VALUES (?)
+            ON CONFLICT(user_id) DO UPDATE SET is_blocked = 0 WHERE is_blocked != 0
+        ''', (user_id,))
+        _invalidate_user(user_id)
+        return True
     except sqlite3.Error as e:
         logger.error(f"Error adding user: {e}")
         return False
 
-@lru_cache(maxsize=100)
-def get_phone_number(user_id: int) -> Optional[str]:
+@cached(user_cache, 'get_phone_number')
+async def get_phone_number(user_id: int) -> Optional[str]:
     """Get user's phone number with caching"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT phone_number FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT phone_number FROM users WHERE user_id = ?', (user_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
     except sqlite3.Error as e:
         logger.error(f"Error fetching phone number: {e}")
         return None
 
-@lru_cache(maxsize=100)
-def get_program(user_id: int) -> Optional[str]:
-    """Get user's program with caching"""
+@cached(user_cache, 'get_program')
+async def get_program(user_id: int) -> Optional[int]:
+    """Get the id of the user's program with caching"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT program FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT program_id FROM users WHERE user_id = ?', (user_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
     except sqlite3.Error as e:
         logger.error(f"Error fetching program: {e}")
         return None
 
-def save_user_program(user_id: int, program: str) -> bool:
-    """Save or update user's program"""
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO users (user_id, program)
-                VALUES (?, ?)
-            ''', (user_id, program))
-            conn.commit()
-            get_program.cache_clear()  # Clear the cache for this user
+async def save_user_program(user_id: int, program_id: int) -> bool:
+    """Save or update the id of the user's program, keeping the rest of the row"""
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute('''
+                INSERT INTO users (user_id, program_id) VALUES (?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET program_id = excluded.program_id
+            ''', (user_id, program_id))
+            await conn.commit()
+            _invalidate_user(user_id)
             return True
     except sqlite3.Error as e:
         logger.error(f"Error saving user program: {e}")
         return False
 
-def save_user_contact(user_id: int, phone_number: str, first_name: str, username: str) -> bool:
+async def migrate_program_titles(titles: dict) -> int:
+    """Move programs stored as titles in users.program to users.program_id, returns the users moved"""
+    try:
+        async with get_db_connection() as conn:
+            async with conn.execute('PRAGMA table_info(users)') as cursor:
+                if 'program' not in [row['name'] for row in await cursor.fetchall()]:
+                    return 0
+            cursor = await conn.executemany(
+                'UPDATE users SET program_id = ?, program = NULL WHERE program = ?',
+                [(program_id, title) for title, program_id in titles.items()]
+            )
+            await conn.commit()
+            if cursor.rowcount:
+                user_cache.clear()
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error migrating programs: {e}")
+        return 0
+
+async def save_user_contact(user_id: int, phone_number: str, first_name: str, username: str) -> bool:
     """Save or update user contact information"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+        async with get_db_connection() as conn:
+            await conn.execute('''
                 UPDATE users
                 SET phone_number = ?, first_name = ?, username = ?
                 WHERE user_id = ?
             ''', (phone_number, first_name, username, user_id))
-            conn.commit()
-            get_phone_number.cache_clear()  # Clear the cache for this user
+            await conn.commit()
+            _invalidate_user(user_id)
             return True
     except sqlite3.Error as e:
         logger.error(f"Error saving user contact: {e}")
         return False
 
-@lru_cache(maxsize=100)
-def get_user_data(user_id: int) -> Optional[Tuple[Any, ...]]:
+@cached(user_cache, 'get_user_data')
+async def get_user_data(user_id: int) -> Optional[Tuple[Any, ...]]:
     """Get all user data with caching"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-            return cursor.fetchone()
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT * FROM users WHERE user_id = ?', (user_id,)) as cursor:
+                return await cursor.fetchone()
     except sqlite3.Error as e:
         logger.error(f"Error fetching user data: {e}")
         return None
 
-def create_ticket(user_id: int) -> int:
+def _recipient_filter(program_id: Optional[int] = None, has_phone: bool = False,
+                      exclude_job_id: Optional[int] = None) -> Tuple[str, list]:
+    """WHERE clause selecting mailing recipients of a segment"""
+    conditions = ['is_blocked = 0']
+    params = []
+    if program_id is not None:
+        conditions.append('program_id = ?')
+        params.append(program_id)
+    if has_phone:
+        conditions.append("phone_number IS NOT NULL AND phone_number != ''")
+    if exclude_job_id is not None:
+        # Users already handled by this job, so a resumed job skips them
+        conditions.append('''NOT EXISTS (
+            SELECT 1 FROM mailing_deliveries d
+            WHERE d.job_id = ? AND d.user_id = users.user_id AND d.status != 'pending'
+        )''')
+        params.append(exclude_job_id)
+    return ' AND '.join(conditions), params
+
+async def iter_user_ids(program_id: Optional[int] = None, has_phone: bool = False, exclude_job_id: Optional[int] = None,
+                        page_size: int = RECIPIENTS_PAGE_SIZE) -> AsyncIterator[int]:
+    """Stream user_id of mailing recipients page by page (keyset on user_id), memory stays flat"""
+    where, params = _recipient_filter(program_id, has_phone, exclude_job_id)
+    last_user_id = -1 << 63
+    while True:
+        try:
+            async with get_db_connection() as conn:
+                async with conn.execute(f'''
+                    SELECT user_id FROM users
+                    WHERE user_id > ? AND {where}
+                    ORDER BY user_id
+                    LIMIT ?
+                ''', (last_user_id, *params, page_size)) as cursor:
+                    page = [row[0] for row in await cursor.fetchall()]
+        except sqlite3.Error as e:
+            logger.error(f"Error fetching mailing recipients: {e}")
+            return
+        # The connection goes back to the pool before the page is consumed
+        for user_id in page:
+            yield user_id
+        if len(page) < page_size:
+            return
+        last_user_id = page[-1]
+
+async def count_user_ids(program_id: Optional[int] = None, has_phone: bool = False,
+                         exclude_job_id: Optional[int] = None) -> int:
+    """Count mailing recipients of a segment"""
+    where, params = _recipient_filter(program_id, has_phone, exclude_job_id)
+    try:
+        async with get_db_connection() as conn:
+            async with conn.execute(f'SELECT COUNT(*) FROM users WHERE {where}', params) as cursor:
+                return (await cursor.fetchone())[0]
+    except sqlite3.Error as e:
+        logger.error(f"Error counting mailing recipients: {e}")
+        return 0
+
+async def get_programs() -> List[int]:
+    """Get the ids of the programs users have chosen"""
+    try:
+        async with get_db_connection() as conn:
+            async with conn.execute(
+                    'SELECT DISTINCT program_id FROM users WHERE program_id IS NOT NULL ORDER BY program_id') as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching programs: {e}")
+        return []
+
+async def mark_user_blocked(user_id: int) -> bool:
+    """Exclude a user who blocked the bot from further mailings"""
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute('UPDATE users SET is_blocked = 1 WHERE user_id = ?', (user_id,))
+            await conn.commit()
+            _invalidate_user(user_id)
+            return True
+    except sqlite3.Error as e:
+        logger.error(f"Error marking user as blocked: {e}")
+        return False
+
+async def create_ticket(user_id: int) -> int:
     """Create a new ticket for a user"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+        async with get_db_connection() as conn:
+            cursor = await conn.execute('''
                 INSERT INTO tickets (user_id)
                 VALUES (?)
             ''', (user_id,))
             ticket_id = cursor.lastrowid
-            conn.commit()
+            await conn.commit()
             return ticket_id
     except sqlite3.Error as e:
         logger.error(f"Error creating ticket: {e}")
         return None
 
-def get_ticket_messages(ticket_id: int) -> List[Tuple]:
+async def get_ticket_messages(ticket_id: int) -> List[Tuple]:
     """Get all messages for a ticket"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM ticket_messages WHERE ticket_id = ?', (ticket_id,))
-            return cursor.fetchall()
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT * FROM ticket_messages WHERE ticket_id = ?', (ticket_id,)) as cursor:
+                return await cursor.fetchall()
     except sqlite3.Error as e:
         logger.error(f"Error fetching ticket messages: {e}")
         return []
 
-def close_ticket(ticket_id: int) -> bool:
+async def close_ticket(ticket_id: int) -> bool:
     """Close a ticket"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+        async with get_db_connection() as conn:
+            await conn.execute('''
                 UPDATE tickets
                 SET status = 'closed'
                 WHERE id = ?
             ''', (ticket_id,))
-            conn.commit()
+            await conn.commit()
             return True
     except sqlite3.Error as e:
         logger.error(f"Error closing ticket: {e}")
         return False
 
-def get_ticket_history(ticket_id: int) -> List[Tuple]:
+async def get_ticket_history(ticket_id: int) -> List[Tuple]:
     """Get the history of a ticket, including the initial question and all subsequent messages"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
+        async with get_db_connection() as conn:
+            async with conn.execute('''
                 SELECT tm.message, tm.created_at, u.username, tm.answer, tm.answer_created_at, a.username AS admin_username
                 FROM ticket_messages tm
                 JOIN users u ON tm.user_id = u.user_id
                 LEFT JOIN users a ON tm.admin_id = a.user_id
                 WHERE tm.ticket_id = ?
                 ORDER BY tm.created_at
-            ''', (ticket_id,))
-            return cursor.fetchall()
+            ''', (ticket_id,)) as cursor:
+                return await cursor.fetchall()
     except sqlite3.Error as e:
         logger.error(f"Error fetching ticket history: {e}")
         return []
 
-def get_user_id_by_ticket_id(ticket_id: int) -> Optional[int]:
+async def get_user_id_by_ticket_id(ticket_id: int) -> Optional[int]:
     """Get user_id associated with a ticket by ticket_id"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT user_id FROM tickets WHERE id = ?', (ticket_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT user_id FROM tickets WHERE id = ?', (ticket_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
     except sqlite3.Error as e:
         logger.error(f"Error fetching user_id for ticket: {e}")
         return None
 
-def get_user_id_by_ticket_message_id(message_id: int) -> Optional[int]:
+async def get_user_id_by_ticket_message_id(message_id: int) -> Optional[int]:
     """Get user_id associated with a ticket message by message_id"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT user_id FROM ticket_messages WHERE message_id = ?', (message_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT user_id FROM ticket_messages WHERE message_id = ?', (message_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
     except sqlite3.Error as e:
         logger.error(f"Error fetching user_id for ticket message: {e}")
         return None
 
-def get_ticket_id_by_message_id(message_id: int) -> Optional[int]:
+async def get_ticket_id_by_message_id(message_id: int) -> Optional[int]:
     """Get ticket_id associated with a message by message_id"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT ticket_id FROM ticket_messages WHERE message_id = ?', (message_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT ticket_id FROM ticket_messages WHERE message_id = ?', (message_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
     except sqlite3.Error as e:
         logger.error(f"Error fetching ticket_id for message: {e}")
         return None
 
-def get_username_by_user_id(user_id: int) -> Optional[str]:
+async def save_admin_messages(rows: List[Tuple[int, int, int, int, int]]) -> bool:
+    """Remember the notifications sent to admins as (admin_chat_id, message_id, ticket_id, user_id, user_message_id)"""
+    try:
+        async with get_db_connection() as conn:
+            await conn.executemany('''
+                INSERT OR REPLACE INTO admin_messages (admin_chat_id, message_id, ticket_id, user_id, user_message_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            await conn.commit()
+            return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving admin messages: {e}")
+        return False
+
+async def get_admin_message_route(admin_chat_id: int, message_id: int) -> Optional[Tuple[int, int, int, str, str]]:
+    """Resolve an admin notification to (ticket_id, user_id, user_message_id, question, username)"""
+    try:
+        async with get_db_connection() as conn:
+            async with conn.execute('''
+                SELECT am.ticket_id, am.user_id, am.user_message_id, COALESCE(tm.question, tm.message), u.username
+                FROM admin_messages am
+                LEFT JOIN ticket_messages tm
+                    ON tm.ticket_id = am.ticket_id AND tm.user_id = am.user_id AND tm.message_id = am.user_message_id
+                LEFT JOIN users u ON u.user_id = am.user_id
+                WHERE am.admin_chat_id = ? AND am.message_id = ?
+            ''', (admin_chat_id, message_id)) as cursor:
+                return await cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching admin message route: {e}")
+        return None
+
+async def get_username_by_user_id(user_id: int) -> Optional[str]:
     """Get username associated with a user by user_id"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT username FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            return result[0] if result else None
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT username FROM users WHERE user_id = ?', (user_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
     except sqlite3.Error as e:
         logger.error(f"Error fetching username for user: {e}")
         return None
 
-def is_ticket_open(ticket_id: int) -> bool:
+async def get_latest_ticket(user_id: int) -> Optional[Tuple[int, bool]]:
+    """Get (ticket_id, is_open) of the user's most recent ticket"""
+    try:
+        async with get_db_connection() as conn:
+            async with conn.execute(
+                    'SELECT id, status FROM tickets WHERE user_id = ? ORDER BY id DESC LIMIT 1', (user_id,)) as cursor:
+                result = await cursor.fetchone()
+                return (result[0], result[1] == 'open') if result else None
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching latest ticket: {e}")
+        return None
+
+async def is_ticket_open(ticket_id: int) -> bool:
     """Check if a ticket is open"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT status FROM tickets WHERE id = ?', (ticket_id,))
-            result = cursor.fetchone()
-            return result[0] == 'open' if result else False
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT status FROM tickets WHERE id = ?', (ticket_id,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] == 'open' if result else False
     except sqlite3.Error as e:
         logger.error(f"Error checking ticket status: {e}")
-        return False
\ No newline at end of file
+        return False
+
+async def create_mailing_job(admin_id: int, text: Optional[str], photo: Optional[str], caption: Optional[str],
+                             segment_program_id: Optional[int] = None, segment_has_phone: bool = False) -> Optional[int]:
+    """Store a mailing, its recipients are streamed from users when it is sent"""
+    try:
+        async with get_db_connection() as conn:
+            cursor = await conn.execute('''
+                INSERT INTO mailing_jobs (admin_id, text, photo, caption, segment_program_id, segment_has_phone)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (admin_id, text, photo, caption, segment_program_id, int(segment_has_phone)))
+            job_id = cursor.lastrowid
+            await conn.commit()
+            return job_id
+    except sqlite3.Error as e:
+        logger.error(f"Error creating mailing job: {e}")
+        return None
+
+async def get_unfinished_mailing_jobs() -> List[Tuple]:
+    """Get mailing jobs that still have recipients to deliver to, oldest first"""
+    try:
+        async with get_db_connection() as conn:
+            async with conn.execute("SELECT * FROM mailing_jobs WHERE status = 'running' ORDER BY id") as cursor:
+                return await cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching mailing jobs: {e}")
+        return []
+
+async def set_mailing_progress_message(job_id: int, message_id: int) -> bool:
+    """Remember the admin message that shows the progress of a job"""
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute('UPDATE mailing_jobs SET progress_message_id = ? WHERE id = ?', (message_id, job_id))
+            await conn.commit()
+            return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving mailing progress message: {e}")
+        return False
+
+async def finish_mailing_job(job_id: int, status: str = 'done') -> bool:
+    """Mark a mailing job as finished"""
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute('''
+                UPDATE mailing_jobs
+                SET status = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (status, job_id))
+            await conn.commit()
+            return True
+    except sqlite3.Error as e:
+        logger.error(f"Error finishing mailing job: {e}")
+        return False
+
+async def set_delivery_status(job_id: int, user_id: int, status: str) -> bool:
+    """Record the outcome of one delivery"""
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute('''
+                INSERT OR REPLACE INTO mailing_deliveries (job_id, user_id, status, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (job_id, user_id, status))
+            await conn.commit()
+            return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving delivery status: {e}")
+        return False
+
+async def get_delivery_counts(job_id: int) -> dict:
+    """Get the number of deliveries of a job per status"""
+    try:
+        async with get_db_connection() as conn:
+            async with conn.execute('''
+                SELECT status, COUNT(*) FROM mailing_deliveries
+                WHERE job_id = ?
+                GROUP BY status
+            ''', (job_id,)) as cursor:
+                return {row[0]: row[1] for row in await cursor.fetchall()}
+    except sqlite3.Error as e:
+        logger.error(f"Error counting deliveries: {e}")
+        return {}
+
+async def get_media_file_id(content_hash: str) -> Optional[str]:
+    """Get the Telegram file_id of an uploaded file by its content hash"""
+    try:
+        async with get_db_connection() as conn:
+            async with conn.execute('SELECT file_id FROM media_files WHERE content_hash = ?', (content_hash,)) as cursor:
+                result = await cursor.fetchone()
+                return result[0] if result else None
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching media file_id: {e}")
+        return None
+
+async def save_media_file_id(content_hash: str, file_id: str, path: Optional[str] = None) -> bool:
+    """Remember the Telegram file_id of an uploaded file"""
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute('''
+                INSERT OR REPLACE INTO media_files (content_hash, file_id, path, updated_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (content_hash, file_id, path))
+            await conn.commit()
+            return True
+    except sqlite3.Error as e:
+        logger.error(f"Error saving media file_id: {e}")
+        return False
+
+async def delete_media_file_id(content_hash: str) -> bool:
+    """Forget a file_id Telegram no longer accepts"""
+    try:
+        async with get_db_connection() as conn:
+            await conn.execute('DELETE FROM media_files WHERE content_hash = ?', (content_hash,))
+            await conn.commit()
+            return True
+    except sqlite3.Error as e:
+        logger.error(f"Error deleting media file_id: {e}")
+        return False
+
+async def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], str]]:
+    """Get (state, data as JSON) of an FSM key, None if it has neither"""
+    async with get_db_connection() as conn:
+        async with conn.execute('SELECT state, data FROM fsm_states WHERE key = ?', (key,)) as cursor:
+            result = await cursor.fetchone()
+            return (result[0], result[1]) if result else None
+
+async def save_fsm_record(key: str, state: Optional[str], data: str) -> None:
+    """Store the state and data (JSON) of an FSM key, an empty record is deleted"""
+    if state is None and data == '{}':
+        await _write('DELETE FROM fsm_states WHERE key = ?', (key,))
+    else:
+        await _write('''
+            INSERT INTO fsm_states (key, state, data) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data
+        ''', (key, state, data))
+
+def slow_queries(limit: int) -> Optional[List[QueryStats]]:
+    """Statements that took the most time since startup, None if the profiler is off"""
+    return _profiler.top(limit) if _profiler is not None else None
+
+
+# Every public query function below is timed, a cached lookup counts with the time of its cache hit
+QUERY_SECONDS = Histogram('bot_db_call_seconds', 'Time of bd.database calls', ['function'])
+QUERY_ROWS = Counter('bot_db_rows_total', 'Rows returned by bd.database calls', ['function'])
+
+
+def _instrument_queries() -> None:
+    """Replace the public coroutine functions of this module by timed ones, before anyone imports them"""
+    module = globals()
+    for name, func in list(module.items()):
+        if name.startswith('_') or getattr(func, '__module__', None) != __name__:
+            continue
+        if inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func):
+            module[name] = instrument(func, QUERY_SECONDS, QUERY_ROWS)
+
+
+_instrument_queries()
@@ -0,0 +1,62 @@
+import json
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from bd.cache import MISSING, TTLCache
+from bd.database import get_fsm_record, save_fsm_record
+
+FSM_CACHE_SIZE = 10000  # Chats whose state is kept in memory
+
+_EMPTY: Tuple[Optional[str], Dict[str, Any]] = (None, {})
+
+
+class SQLiteStorage(BaseStorage):
+    """aiogram FSM storage kept in the fsm_states table, behind a write-through LRU cache.
+
+    Reads of a chat seen since the start cost no I/O, every change is written to the database
+    before the call returns, so a restart continues every flow where it stopped. Errors are
+    not swallowed here: a handler whose state was not saved must fail like any other.
+    """
+
+    def __init__(self, key_builder: Optional[KeyBuilder] = None, cache_size: int = FSM_CACHE_SIZE):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._cache = TTLCache('fsm', maxsize=cache_size)  # key -> (state, data)
+
+    async def _load(self, key: StorageKey) -> Tuple[str, Tuple[Optional[str], Dict[str, Any]]]:
+        db_key = self.key_builder.build(key)
+        record = self._cache.get(db_key)
+        if record is MISSING:
+            generation = self._cache.generation(db_key)
+            stored = await get_fsm_record(db_key)
+            record = (stored[0], json.loads(stored[1])) if stored else _EMPTY
+            self._cache.set(db_key, record, generation)
+        return db_key, record
+
+    async def _save(self, db_key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        await save_fsm_record(db_key, state, json.dumps(data, ensure_ascii=False))
+        self._cache.set(db_key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key, (_, data) = await self._load(key)
+        await self._save(db_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, (state, _) = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        db_key, (state, _) = await self._load(key)
+        await self._save(db_key, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, (_, data) = await self._load(key)
+        return data.copy()
+
+    async def close(self) -> None:
+        # Connections belong to the pool in bd.database, closed by close_db()
+        pass
@@ -0,0 +1,163 @@
+import inspect
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds, from a cached lookup to a slow Telegram call
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), register: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        if register:
+            _registry[name] = self
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return '\n'.join((f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}',
+                          *self._samples()))
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), register: bool = True):
+        super().__init__(name, documentation, labelnames, register)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+
+
+class Histogram(_Metric):
+    """Cumulative buckets, sum and count per label set, as Prometheus expects them"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, register: bool = True):
+        super().__init__(name, documentation, labelnames, register)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, List] = {}  # labels -> [per-bucket counts + overflow, sum]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time spent in the with block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def _samples(self) -> Iterable[str]:
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                labels = _format_labels((*self.labelnames, 'le'), (*key, bound))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {total}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+_registry: Dict[str, _Metric] = {}
+# Called on every scrape, each returns unregistered metrics computed from state kept elsewhere
+_collectors: List[Callable[[], Iterable[_Metric]]] = []
+
+
+def register_collector(collector: Callable[[], Iterable[_Metric]]) -> None:
+    _collectors.append(collector)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    metrics = list(_registry.values())
+    for collector in _collectors:
+        metrics.extend(collector())
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def _row_count(result) -> int:
+    """Rows a query function returned: a list or dict per item, nothing for None or a write's bool"""
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return 0 if result is None or isinstance(result, bool) else 1
+
+
+def instrument(func, seconds: Histogram, rows: Counter):
+    """Wrap a coroutine or async generator function to record its time and the rows it returns.
+
+    An async generator is timed only while it produces items, not while its consumer works.
+    """
+    name = func.__name__
+    if inspect.isasyncgenfunction(func):
+        @wraps(func)
+        async def generator_wrapper(*args, **kwargs):
+            elapsed, count = 0.0, 0
+            generator = func(*args, **kwargs)
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        item = await generator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        elapsed += time.perf_counter() - started
+                    count += 1
+                    yield item
+            finally:
+                await generator.aclose()
+                seconds.observe(elapsed, function=name)
+                rows.inc(count, function=name)
+        return generator_wrapper
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        with seconds.time(function=name):
+            result = await func(*args, **kwargs)
+        rows.inc(_row_count(result), function=name)
+        return result
+    return wrapper
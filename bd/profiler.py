@@ -0,0 +1,173 @@
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Statements that get a query plan, the rest (BEGIN, PRAGMA, CREATE ...) has none worth keeping
+_PLANNED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def normalize(sql: str) -> str:
+    """One line per statement, the key of its statistics"""
+    return ' '.join(sql.split())
+
+
+def is_full_scan(detail: str) -> bool:
+    """'SCAN users' reads the whole table, 'SCAN users USING INDEX ...' and 'SEARCH ...' do not"""
+    return detail.startswith('SCAN ') and 'INDEX' not in detail and detail != 'SCAN CONSTANT ROW'
+
+
+@dataclass
+class QueryStats:
+    sql: str
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    plan: List[str] = field(default_factory=list)
+    full_scan: bool = False
+
+    @property
+    def average(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class QueryProfiler:
+    """Times every statement run on a profiled connection, see connection_factory().
+
+    A statement is timed from its execution until its cursor is exhausted or closed, so the
+    rows it fetches count too. Statements slower than `threshold` seconds are logged with
+    their parameters. The plan of each distinct statement is captured the first time it runs,
+    a full table scan in it is logged once.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._stats: Dict[str, QueryStats] = {}
+        # Every pooled connection records from its own thread
+        self._lock = threading.Lock()
+
+    def connection_factory(self) -> type:
+        """sqlite3.connect(factory=...) for connections whose statements this profiler records"""
+        return type('ProfiledConnection', (ProfilingConnection,), {'profiler': self})
+
+    def explain(self, conn: sqlite3.Connection, sql: str, parameters: Any) -> None:
+        key = normalize(sql)
+        with self._lock:
+            if key in self._stats:
+                return
+            stats = self._stats[key] = QueryStats(key)
+        if not key.upper().startswith(_PLANNED):
+            return
+        try:
+            rows = sqlite3.Connection.execute(conn, f'EXPLAIN QUERY PLAN {sql}', parameters).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Error explaining query {key}: {e}")
+            return
+        stats.plan = [row[3] for row in rows]
+        stats.full_scan = any(is_full_scan(detail) for detail in stats.plan)
+        if stats.full_scan:
+            logger.warning(f"Full table scan in query {key}: {'; '.join(stats.plan)}")
+
+    def record(self, sql: str, parameters: Any, elapsed: float) -> None:
+        key = normalize(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats(key)
+            stats.count += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+        if elapsed >= self.threshold:
+            logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {key} parameters={parameters!r}")
+
+    def top(self, limit: int) -> List[QueryStats]:
+        """Statements that took the most time in total, slowest first"""
+        with self._lock:
+            stats = [s for s in self._stats.values() if s.count]
+        return sorted(stats, key=lambda s: s.total, reverse=True)[:limit]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    _sql: Optional[str] = None
+    _parameters: Any = None
+    _elapsed = 0.0
+
+    def _start(self, sql: str, parameters: Any) -> None:
+        self._finish()
+        self._sql, self._parameters, self._elapsed = sql, parameters, 0.0
+
+    def _finish(self) -> None:
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            self.connection.profiler.record(sql, self._parameters, self._elapsed)
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    def execute(self, sql: str, parameters: Any = ()) -> 'ProfilingCursor':
+        self.connection.profiler.explain(self.connection, sql, parameters)
+        self._start(sql, parameters)
+        self._timed(super().execute, sql, parameters)
+        if self.description is None:
+            # Not a query: nothing left to fetch
+            self._finish()
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Sequence) -> 'ProfilingCursor':
+        if isinstance(seq_of_parameters, (list, tuple)) and seq_of_parameters:
+            self.connection.profiler.explain(self.connection, sql, seq_of_parameters[0])
+        rows = len(seq_of_parameters) if hasattr(seq_of_parameters, '__len__') else '?'
+        self._start(sql, f'<{rows} parameter sets>')
+        self._timed(super().executemany, sql, seq_of_parameters)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size: int = None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # A write awaited as `await conn.execute(...)` is finished above, this covers unread queries
+        self._finish()
+
+
+class ProfilingConnection(sqlite3.Connection):
+    profiler: QueryProfiler
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = ()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Sequence):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,141 @@
+"""Stress test of per-chat ordering: interleaved updates of many chats, with and without ChatEventIsolation.
+
+Every chat first sends "ask", whose handler puts it in a question state, like the feedback button does.
+Then it sends ``--messages`` numbered messages, interleaved round-robin with the other chats and fed to
+the dispatcher as concurrent tasks the way polling does. The handler of the question state sleeps for a
+random I/O-like time, opens a ticket and leaves the state, like Feedback.ask_question; the later messages
+go to a stateless handler that sleeps too. Both record the message after their sleep.
+
+The benchmark reports throughput, the largest number of handlers running at once, chats with more than
+one ticket, messages finished out of order and handlers of one chat that overlapped. With the isolation
+every chat must have exactly one ticket, for its message 0, and the other numbers must be zero,
+otherwise it exits with an error.
+
+    python -m benchmarks.bench_chat_order --chats 200 --messages 20 --concurrency 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, F, Router  # noqa: E402
+from aiogram.fsm.context import FSMContext  # noqa: E402
+from aiogram.fsm.state import State, StatesGroup  # noqa: E402
+from aiogram.types import Message, Update  # noqa: E402
+
+from app.utils.ordering import ChatEventIsolation  # noqa: E402
+from benchmarks.post_updates import FIRST_USER_ID, message_update  # noqa: E402
+
+
+class Question(StatesGroup):
+    ask = State()
+
+
+class Recorder:
+    def __init__(self, max_delay):
+        self.max_delay = max_delay
+        self.last_finished = {}
+        self.tickets = {}  # chat -> numbers of the messages that opened a ticket
+        self.active_chats = set()
+        self.running = self.max_running = 0
+        self.out_of_order = self.overlaps = self.handled = 0
+
+    async def ask(self, message: Message, state: FSMContext):
+        await state.set_state(Question.ask)
+
+    async def question(self, message: Message, state: FSMContext):
+        async with self._handling(message):
+            self.tickets.setdefault(message.chat.id, []).append(int(message.text))
+            await state.clear()
+
+    async def message(self, message: Message):
+        async with self._handling(message):
+            pass
+
+    @asynccontextmanager
+    async def _handling(self, message: Message):
+        chat_id, number = message.chat.id, int(message.text)
+        if chat_id in self.active_chats:
+            self.overlaps += 1
+        self.active_chats.add(chat_id)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(random.uniform(0, self.max_delay))
+            yield
+            # Checked after the await: that is where an unordered run lets the next message in
+            if number != self.last_finished.get(chat_id, -1) + 1:
+                self.out_of_order += 1
+            self.last_finished[chat_id] = number
+        finally:
+            self.running -= 1
+            self.active_chats.discard(chat_id)
+            self.handled += 1
+
+
+async def run(ordered, args):
+    recorder = Recorder(args.max_delay / 1000)
+    router = Router()
+    router.message(F.text == 'ask')(recorder.ask)
+    router.message(Question.ask)(recorder.question)
+    router.message()(recorder.message)
+    isolation = ChatEventIsolation(args.concurrency, max_pending=args.messages) if ordered else None
+    dp = Dispatcher(events_isolation=isolation)
+    dp.include_router(router)
+    bot = Bot('42:BENCHMARK')
+
+    def update(chat, text):
+        return Update.model_validate(message_update(FIRST_USER_ID + chat, text), context={'bot': bot})
+
+    await asyncio.gather(*(dp.feed_update(bot, update(chat, 'ask')) for chat in range(args.chats)))
+    updates = [update(chat, str(number)) for number in range(args.messages) for chat in range(args.chats)]
+    # Like Dispatcher.start_polling(tasks_concurrency_limit=...): admit in order, at most in_flight at once
+    in_flight = asyncio.Semaphore(args.in_flight)
+
+    async def process(update):
+        try:
+            await dp.feed_update(bot, update)
+        finally:
+            in_flight.release()
+
+    tasks = []
+    started = time.perf_counter()
+    for update in updates:
+        await in_flight.acquire()
+        tasks.append(asyncio.create_task(process(update)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    return recorder, len(updates) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=100, help='handlers running at once')
+    parser.add_argument('--in-flight', type=int, default=1000, help='updates admitted at once')
+    parser.add_argument('--max-delay', type=float, default=50.0, help='handler I/O time, ms, about a Bot API call')
+    args = parser.parse_args()
+
+    for name, ordered in (('unordered', False), ('per-chat', True)):
+        recorder, rate = asyncio.run(run(ordered, args))
+        tickets = Counter(len(numbers) for numbers in recorder.tickets.values())
+        duplicates = sum(count for opened, count in tickets.items() if opened > 1)
+        print(f"{name:>10}: {rate:8.0f} updates/s, {recorder.max_running:4} handlers at once, "
+              f"{duplicates:5} chats with duplicate tickets, {recorder.out_of_order:5} out of order, "
+              f"{recorder.overlaps:5} overlapping in a chat")
+        if ordered and (recorder.tickets != {FIRST_USER_ID + chat: [0] for chat in range(args.chats)}
+                        or recorder.out_of_order or recorder.overlaps
+                        or recorder.handled != args.chats * args.messages):
+            raise SystemExit("per-chat ordering violated")
+
+
+if __name__ == '__main__':
+    main()
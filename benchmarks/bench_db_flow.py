@@ -0,0 +1,112 @@
+"""Messages/sec for the /start -> contact -> question flow, before and after the pooled DB layer.
+
+"before" replays the same statements through a fresh ``sqlite3.connect`` per call on the event loop
+(the old ``bd/database.py``), "after" goes through the async pool in ``bd.database``.
+Besides throughput it reports the worst event-loop stall, i.e. how long every other chat waited.
+
+    python -m benchmarks.bench_db_flow --users 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bd import database  # noqa: E402
+
+MESSAGES_PER_USER = 3  # /start, contact, question
+
+
+def legacy_call(db_path, sql, params=(), fetch=False):
+    """One call of the old data-access layer: connect, execute, commit, close"""
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(sql, params)
+        if fetch:
+            return cursor.fetchone()
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+async def legacy_flow(db_path, user_id):
+    legacy_call(db_path, 'INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+    legacy_call(db_path, 'UPDATE users SET phone_number = ?, first_name = ?, username = ? WHERE user_id = ?',
+                ('+70000000000', 'Bench', f'bench{user_id}', user_id))
+    legacy_call(db_path, 'SELECT * FROM users WHERE user_id = ?', (user_id,), fetch=True)
+    legacy_call(db_path, 'SELECT program_id FROM users WHERE user_id = ?', (user_id,), fetch=True)
+    ticket_id = legacy_call(db_path, 'INSERT INTO tickets (user_id) VALUES (?)', (user_id,))
+    legacy_call(db_path, '''
+        INSERT INTO ticket_messages (user_id, message, message_id, question, ticket_id)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, 'question', user_id, 'question', ticket_id))
+    legacy_call(db_path, 'SELECT ticket_id FROM ticket_messages WHERE message_id = ?', (user_id,), fetch=True)
+    await asyncio.sleep(0)
+
+
+async def pooled_flow(db_path, user_id):
+    await database.add_user_if_not_exists(user_id)
+    await database.save_user_contact(user_id, '+70000000000', 'Bench', f'bench{user_id}')
+    await database.get_user_data(user_id)
+    await database.get_program(user_id)
+    ticket_id = await database.create_ticket(user_id)
+    await database.save_question(user_id=user_id, question='question', message_id=user_id, ticket_id=ticket_id)
+    await database.get_ticket_id_by_message_id(user_id)
+
+
+async def watch_loop(stop: asyncio.Event, interval: float = 0.001) -> float:
+    """Return the longest delay between two scheduled wake-ups of the loop"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def run(flow, users: int, concurrency: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        database.DB_PATH = db_path
+        await database.init_db()
+        if flow is legacy_flow:
+            # The old layer never switched the file to WAL
+            await database.close_db()
+            with sqlite3.connect(db_path) as conn:
+                conn.execute('PRAGMA journal_mode=DELETE')
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(user_id):
+            async with semaphore:
+                await flow(db_path, user_id)
+
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(watch_loop(stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(one(user_id) for user_id in range(1, users + 1)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        stall = await watcher
+        await database.close_db()
+    return users * MESSAGES_PER_USER / elapsed, stall
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    for name, flow in (('before', legacy_flow), ('after', pooled_flow)):
+        rate, stall = await run(flow, args.users, args.concurrency)
+        print(f"{name:>6}: {rate:8.1f} messages/sec, worst loop stall {stall * 1000:7.1f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+"""End-to-end benchmark of the real dispatcher from run.py against a fake Telegram Bot API, fully offline.
+
+The bot's requests never leave the process: a fake aiogram session answers every API call, after
+``--api-latency`` ms, with a made-up message or True. Updates are fed to ``run.create_dispatcher()``
+the way polling does, so routers, middlewares, FSM storage and the database are the production ones,
+on a temporary database.
+
+Every simulated user waits for the bot to handle an update before sending the next, many users at a
+time. The phases run in this order:
+
+- start: every user sends /start
+- program: every user picks a program
+- contact: every user shares a phone number
+- feedback: every user taps "feedback", asks a question and sends a follow-up message
+- replies: the admins reply to the question notifications, each admin one reply at a time
+- mailing: an admin goes through the mailing dialog, the mailing worker delivers to every user
+
+For each phase the benchmark reports updates/s, p50/p95/p99 latency of an update from dispatch to
+the end of handling, and the Bot API calls made. The peak RSS of the process is printed at the end.
+
+    python -m benchmarks.bench_e2e --users 1000 --mailing-users 10000 --api-latency 0
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List
+
+import structlog
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import GetMe, SendMediaGroup, TelegramMethod  # noqa: E402
+from aiogram.types import Chat, Message, Update, User  # noqa: E402
+
+import run  # noqa: E402
+from app.context import AppContext  # noqa: E402
+from app.programs import CALLBACK_PREFIX, PROGRAMS  # noqa: E402
+from app.utils.broadcast import Broadcaster  # noqa: E402
+from app.utils.mailing import MailingWorker  # noqa: E402
+from bd import database  # noqa: E402
+from setings import ADMIN_ID, UPDATES_IN_FLIGHT  # noqa: E402
+
+BOT_TOKEN = '42:BENCHMARK'
+FIRST_USER_ID = 10 ** 9
+
+
+class FakeSession(BaseSession):
+    """Answers Bot API calls in memory, counting them by method"""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+
+    def _message(self, chat_id: Any, text: str = None) -> Message:
+        chat_id = chat_id if isinstance(chat_id, int) else 0
+        return Message(message_id=next(self._message_ids), date=datetime.now(),
+                       chat=Chat(id=chat_id, type='private'), text=text)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int = None) -> Any:
+        self.calls[type(method).__name__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, SendMediaGroup):
+            return [self._message(method.chat_id) for _ in method.media]
+        if isinstance(method, GetMe):
+            return User(id=bot.id, is_bot=True, first_name='Benchmark')
+        if method.__returning__ is Message:
+            return self._message(method.chat_id, getattr(method, 'text', None))
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError("the benchmark downloads no files")
+        yield b''  # An async generator, like the real method
+
+    async def close(self) -> None:
+        pass
+
+
+class Updates:
+    """Synthetic updates shaped like the ones Telegram sends"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(10 ** 6)
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load{user_id}'}
+
+    @staticmethod
+    def _chat(user_id: int) -> Dict[str, Any]:
+        return {'id': user_id, 'type': 'private', 'first_name': 'Load', 'username': f'load{user_id}'}
+
+    def _update(self, **payload) -> Update:
+        return Update.model_validate({'update_id': next(self._update_ids), **payload}, context={'bot': self.bot})
+
+    def message(self, user_id: int, **fields) -> Update:
+        return self._update(message={'message_id': next(self._message_ids), 'date': int(time.time()),
+                                     'chat': self._chat(user_id), 'from': self._user(user_id), **fields})
+
+    def text(self, user_id: int, text: str) -> Update:
+        return self.message(user_id, text=text)
+
+    def contact(self, user_id: int) -> Update:
+        return self.message(user_id, contact={'phone_number': f'+7{user_id}', 'first_name': 'Load',
+                                              'user_id': user_id})
+
+    def reply(self, user_id: int, text: str, reply_to_message_id: int) -> Update:
+        replied = {'message_id': reply_to_message_id, 'date': int(time.time()), 'chat': self._chat(user_id)}
+        return self.message(user_id, text=text, reply_to_message=replied)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        bot_message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                       'chat': self._chat(user_id), 'text': 'menu'}
+        return self._update(callback_query={'id': str(next(self._update_ids)), 'from': self._user(user_id),
+                                            'chat_instance': str(user_id), 'message': bot_message, 'data': data})
+
+
+class Feeder:
+    """Feeds updates like Dispatcher.start_polling: at most UPDATES_IN_FLIGHT handled at once"""
+
+    def __init__(self, dp, bot: Bot, in_flight: int = UPDATES_IN_FLIGHT):
+        self.dp = dp
+        self.bot = bot
+        self._in_flight = asyncio.Semaphore(in_flight)
+        self.latencies: List[float] = []
+
+    async def feed(self, update: Update) -> None:
+        async with self._in_flight:
+            started = time.perf_counter()
+            await self.dp.feed_update(self.bot, update)
+            self.latencies.append(time.perf_counter() - started)
+
+    async def conversation(self, updates) -> None:
+        """One user's updates, each sent once the previous one is handled"""
+        for update in updates:
+            await self.feed(update)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name: str, count: int, elapsed: float, latencies: List[float], calls: Counter) -> None:
+    latencies = sorted(latencies)
+    p50, p95, p99 = (percentile(latencies, f) * 1000 for f in (0.5, 0.95, 0.99))
+    print(f"{name:>8}: {count:6} updates in {elapsed:6.2f} s, {count / elapsed:7.0f} updates/s, "
+          f"p50 {p50:6.2f} ms, p95 {p95:6.2f} ms, p99 {p99:7.2f} ms, "
+          f"{sum(calls.values())} API calls ({', '.join(f'{n} {m}' for m, n in calls.most_common(3))})")
+
+
+async def run_phase(name: str, feeder: Feeder, session: FakeSession, conversations) -> None:
+    feeder.latencies = []
+    calls_before = Counter(session.calls)
+    started = time.perf_counter()
+    await asyncio.gather(*(feeder.conversation(updates) for updates in conversations))
+    elapsed = time.perf_counter() - started
+    report(name, len(feeder.latencies), elapsed, feeder.latencies, session.calls - calls_before)
+
+
+async def notification_ids(admin_id: int) -> List[int]:
+    """Message ids of the question notifications an admin got"""
+    async with database.get_db_connection() as conn:
+        async with conn.execute('SELECT message_id FROM admin_messages WHERE admin_chat_id = ? ORDER BY message_id',
+                                (admin_id,)) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+async def run_mailing(feeder: Feeder, updates: Updates, worker_task: asyncio.Task) -> None:
+    """From the admin's first message to the last delivery of the mailing"""
+    admin_id = ADMIN_ID[0]
+    dialog = ["рассылка", "Нагрузочная рассылка", "Нет", "Все пользователи", "Да"]
+    started = time.perf_counter()
+    await feeder.conversation(updates.text(admin_id, text) for text in dialog)
+    jobs = await database.get_unfinished_mailing_jobs()
+    if not jobs:
+        raise SystemExit("the mailing dialog did not create a job")
+    while await database.get_unfinished_mailing_jobs():
+        if worker_task.done():
+            raise SystemExit(f"mailing worker stopped: {worker_task.exception()!r}")
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    counts = await database.get_delivery_counts(jobs[0]['id'])
+    delivered = sum(counts.values())
+    print(f"{'mailing':>8}: {delivered:6} deliveries in {elapsed:6.2f} s, {delivered / elapsed:7.0f} deliveries/s, "
+          f"{dict(counts)}")
+
+
+async def seed_users(first: int, last: int) -> None:
+    """Users who only ever sent /start, the rest of the mailing audience"""
+    user_ids = range(first, last)
+    for chunk in range(0, len(user_ids), 500):
+        await asyncio.gather(*(database.add_user_if_not_exists(user_id) for user_id in user_ids[chunk:chunk + 500]))
+
+
+async def run_benchmark(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'bench.db')
+        session = FakeSession(args.api_latency / 1000)
+        bot = Bot(BOT_TOKEN, session=session)
+        broadcaster = Broadcaster(bot, rate=args.mailing_rate)
+        ctx = AppContext(bot=bot, broadcaster=broadcaster, mailing_worker=MailingWorker(bot, broadcaster))
+        dp = run.create_dispatcher(**ctx.workflow_data())
+        await database.init_db(write_behind=args.write_behind)
+        worker_task = ctx.mailing_worker.start()
+
+        feeder = Feeder(dp, bot)
+        updates = Updates(bot)
+        user_ids = range(FIRST_USER_ID, FIRST_USER_ID + args.users)
+        program_ids = list(PROGRAMS)
+        try:
+            await run_phase('start', feeder, session, [[updates.text(u, '/start')] for u in user_ids])
+            await run_phase('program', feeder, session, [
+                [updates.callback(u, f'{CALLBACK_PREFIX}{program_ids[u % len(program_ids)]}')] for u in user_ids])
+            await run_phase('contact', feeder, session, [[updates.contact(u)] for u in user_ids])
+            await run_phase('feedback', feeder, session, [
+                [updates.callback(u, 'feedback'), updates.text(u, 'Вопрос о тренировке'), updates.text(u, 'Уточнение')]
+                for u in user_ids])
+            replies = []
+            for admin_id in ADMIN_ID:
+                message_ids = (await notification_ids(admin_id))[:args.replies // len(ADMIN_ID)]
+                replies.append([updates.reply(admin_id, 'Ответ администратора', message_id)
+                                for message_id in message_ids])
+            await run_phase('replies', feeder, session, replies)
+
+            await seed_users(FIRST_USER_ID + args.users, FIRST_USER_ID + max(args.mailing_users, args.users))
+            await run_mailing(feeder, updates, worker_task)
+        finally:
+            worker_task.cancel()
+            await bot.session.close()
+            await database.close_db()
+
+    # ru_maxrss is in kilobytes on Linux
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000, help='users going through start to feedback')
+    parser.add_argument('--mailing-users', type=int, default=10000, help='recipients of the mailing')
+    parser.add_argument('--replies', type=int, default=300, help='admin replies, split between the admins')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='ms the fake Bot API takes per call')
+    parser.add_argument('--mailing-rate', type=float, default=10 ** 6,
+                        help='mailing messages per second, production sends 25')
+    parser.add_argument('--write-behind', action='store_true', help='run with DB_WRITE_BEHIND enabled')
+    args = parser.parse_args()
+
+    # Per-update logs of aiogram and the handlers would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('aiogram').setLevel(logging.WARNING)
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == '__main__':
+    main()
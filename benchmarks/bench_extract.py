@@ -0,0 +1,128 @@
+"""Parse time and peak memory of the schedule extractor, old BeautifulSoup path vs the lxml path.
+
+Before timing, both paths are checked against the golden output stored next to every
+fixture (``fixtures/<name>.html`` -> ``fixtures/<name>.json``); no network is used.
+
+    python -m benchmarks.bench_extract --repeat 200
+    python -m benchmarks.bench_extract --html saved_schedule_page.html
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from app.utils.schedule import extract_schedule  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def legacy_extract_schedule(html_content):
+    """extract_schedule() as it was before the lxml rewrite"""
+    if not html_content:
+        return []
+
+    soup = BeautifulSoup(html_content, "lxml")
+    schedule = []
+
+    days = soup.select("div.col")
+    for day in days:
+        date_div = day.select_one("div.cel.date")
+        if not date_div:
+            continue
+
+        date = date_div.text.strip()
+        events = day.select("div[class*='cel class'], div[class*='ct-']")
+
+        for event in events:
+            if "cel not" in event.get("class", []):
+                continue
+
+            schedule.append({
+                "date": date,
+                "time": event.select_one("div.time").text.strip() if event.select_one("div.time") else "N/A",
+                "lesson": event.select_one("span.lesson").text.strip() if event.select_one("span.lesson") else "N/A",
+                "trainer": event.select_one("span.name").text.strip() if event.select_one("span.name") else "N/A",
+                "room": event.select_one("span.number").text.strip() if event.select_one("span.number") else "N/A",
+            })
+
+    return schedule
+
+
+PATHS = {'old': legacy_extract_schedule, 'new': extract_schedule}
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def check_golden():
+    """Both paths must produce exactly the stored dicts for every fixture"""
+    for html_path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        golden_path = os.path.splitext(html_path)[0] + '.json'
+        if not os.path.exists(golden_path):
+            continue
+        html_content = read(html_path)
+        expected = json.loads(read(golden_path))
+        for name, extract in PATHS.items():
+            result = extract(html_content)
+            if result != expected:
+                raise SystemExit(f"{name} path differs from {os.path.basename(golden_path)}")
+        print(f"golden ok: {os.path.basename(html_path)} ({len(expected)} rows)")
+    if extract_schedule('') != legacy_extract_schedule(''):
+        raise SystemExit("paths differ on an empty page")
+
+
+def measure(name, html_path, repeat, results):
+    """Runs in a fresh process so that peak RSS belongs to one path only"""
+    extract = PATHS[name]
+    html_content = read(html_path)
+    extract(html_content)  # warm up imports and parser state
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        extract(html_content)
+    elapsed = time.perf_counter() - started
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+
+    tracemalloc.start()
+    extract(html_content)
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results[name] = (elapsed / repeat, heap_peak, rss_growth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--html', default=os.path.join(FIXTURES_DIR, 'schedule_week.html'))
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    check_golden()
+
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        results = manager.dict()
+        for name in PATHS:
+            process = context.Process(target=measure, args=(name, args.html, args.repeat, results))
+            process.start()
+            process.join()
+        for name in PATHS:
+            per_parse, heap_peak, rss_growth = results[name]
+            print(f"{name}: {per_parse * 1000:7.3f} ms/parse, "
+                  f"python heap peak {heap_peak / 1024:8.1f} KiB, RSS growth {rss_growth:6d} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""FSM storage cost per update: MemoryStorage against SQLiteStorage, hot and cold.
+
+Every simulated update does what a step of the question or mailing flow does: ``get_state``,
+``update_data`` and ``set_state``. "hot" repeats the steps for chats already in the front cache,
+"cold" uses a fresh storage instance so every chat is read from the database first. At the end
+the benchmark checks that a new SQLiteStorage sees the state left by the previous one.
+
+    python -m benchmarks.bench_fsm_storage --chats 2000 --rounds 5
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+from bd import database  # noqa: E402
+from bd.fsm_storage import SQLiteStorage  # noqa: E402
+
+BOT_ID = 42
+STATE = 'Mailing:text'
+
+
+def keys(chats):
+    return [StorageKey(bot_id=BOT_ID, chat_id=chat_id, user_id=chat_id) for chat_id in range(1, chats + 1)]
+
+
+async def step(storage, key, round_no):
+    await storage.get_state(key)
+    await storage.update_data(key, {'round': round_no, 'text': 'x' * 64})
+    await storage.set_state(key, STATE)
+
+
+async def timed(storage, storage_keys, rounds):
+    started = time.perf_counter()
+    for round_no in range(rounds):
+        await asyncio.gather(*(step(storage, key, round_no) for key in storage_keys))
+    return (time.perf_counter() - started) / (rounds * len(storage_keys))
+
+
+async def run(chats, rounds):
+    storage_keys = keys(chats)
+    results = {'memory': await timed(MemoryStorage(), storage_keys, rounds)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'bench.db')
+        await database.init_db()
+        try:
+            results['sqlite cold'] = await timed(SQLiteStorage(), storage_keys, 1)
+            storage = SQLiteStorage()
+            await timed(storage, storage_keys, 1)  # warm the front cache
+            results['sqlite hot'] = await timed(storage, storage_keys, rounds)
+
+            restarted = SQLiteStorage()
+            for key in storage_keys:
+                if await restarted.get_state(key) != STATE or (await restarted.get_data(key))['round'] != rounds - 1:
+                    raise SystemExit(f"state of chat {key.chat_id} was not persisted")
+        finally:
+            await database.close_db()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    for name, per_update in asyncio.run(run(args.chats, args.rounds)).items():
+        print(f"{name:>12}: {per_update * 1e6:9.1f} µs per update")
+
+
+if __name__ == '__main__':
+    main()
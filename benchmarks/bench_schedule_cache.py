@@ -0,0 +1,56 @@
+"""Load time and size of the schedule cache: legacy JSON vs the columnar binary file.
+
+    python -m benchmarks.bench_schedule_cache --weeks 4 --repeat 2000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.schedule_model import Schedule  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        cache = json.load(f)
+    return Schedule.from_rows(cache['data'], cache['timestamp'])
+
+
+def timed(func, path, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func(path)
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--weeks', type=int, default=1, help='repeat the committed week to grow the cache')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, 'schedule_cache.json'), 'r', encoding='utf-8') as f:
+        cache = json.load(f)
+    cache['data'] = cache['data'] * args.weeks
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'schedule_cache.json')
+        bin_path = os.path.join(tmp, 'schedule_cache.bin')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        Schedule.from_rows(cache['data'], cache['timestamp']).dump(bin_path)
+        assert Schedule.load(bin_path).rows() == load_json(json_path).rows()
+
+        for name, func, path in (('json', load_json, json_path), ('binary', Schedule.load, bin_path)):
+            per_load = timed(func, path, args.repeat)
+            print(f"{name:>6}: {per_load * 1e6:8.1f} us/load, {os.path.getsize(path):7d} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Inserts/sec and handler latency for a burst of feedback messages, with and without write-behind.
+
+Every simulated handler does what a feedback message does: ``add_user_if_not_exists`` followed by
+``save_ticket_message``. All of them start at once, as in a reply storm after a mailing. Besides
+throughput the benchmark reports p50/p99 of the handler latency and checks that every row landed.
+
+    python -m benchmarks.bench_write_behind --messages 5000 --synchronous FULL
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bd import database  # noqa: E402
+
+TICKET_ID = 1
+
+
+async def handler(user_id, latencies):
+    started = time.perf_counter()
+    await database.add_user_if_not_exists(user_id)
+    await database.save_ticket_message(TICKET_ID, user_id, 'reply', user_id)
+    latencies.append(time.perf_counter() - started)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(write_behind, messages, synchronous):
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'bench.db')
+        await database.init_db(write_behind=write_behind)
+        # Production keeps NORMAL, FULL shows the cost of one fsync per commit
+        pool = database._pool
+        connections = [pool.get_nowait() for _ in range(pool.qsize())]
+        for conn in connections:
+            await conn.execute(f'PRAGMA synchronous={synchronous}')
+            pool.put_nowait(conn)
+
+        latencies = []
+        started = time.perf_counter()
+        await asyncio.gather(*(handler(user_id, latencies) for user_id in range(1, messages + 1)))
+        elapsed = time.perf_counter() - started
+
+        async with database.get_db_connection() as conn:
+            async with conn.execute('SELECT COUNT(*) FROM ticket_messages') as cursor:
+                stored = (await cursor.fetchone())[0]
+        await database.close_db()
+
+    if stored != messages:
+        raise SystemExit(f"write_behind={write_behind}: {stored} of {messages} messages stored")
+    return messages * 2 / elapsed, percentile(latencies, 0.5), percentile(latencies, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--synchronous', default='NORMAL', choices=['OFF', 'NORMAL', 'FULL'])
+    args = parser.parse_args()
+
+    for name, write_behind in (('direct', False), ('write-behind', True)):
+        rate, p50, p99 = asyncio.run(run(write_behind, args.messages, args.synchronous))
+        print(f"{name:>12}: {rate:9.0f} inserts/s, handler p50 {p50 * 1000:7.2f} ms, p99 {p99 * 1000:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Fake Telegram: post synthetic updates to a locally running webhook and report how fast it accepts them.
+
+Start the bot with RUN_MODE = "webhook" and an empty WEBHOOK_BASE_URL (so Telegram is not told
+about it), then run
+
+    python -m benchmarks.post_updates --url http://127.0.0.1:8080/webhook --updates 1000 --concurrency 50
+
+Every update is a private text message from its own user, like the ones Telegram posts.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+FIRST_USER_ID = 10 ** 9
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id, text):
+    update_id = next(_update_ids)
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f'load{user_id}'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': 'Load', 'username': f'load{user_id}'},
+            'from': user,
+            'text': text,
+        },
+    }
+
+
+async def post(session, url, update, headers, latencies, statuses):
+    started = time.perf_counter()
+    async with session.post(url, json=update, headers=headers) as response:
+        await response.read()
+        statuses[response.status] = statuses.get(response.status, 0) + 1
+    latencies.append(time.perf_counter() - started)
+
+
+async def run(args):
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret} if args.secret else {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, statuses = [], {}
+
+    async def limited(update):
+        async with semaphore:
+            await post(session, args.url, update, headers, latencies, statuses)
+
+    async with aiohttp.ClientSession() as session:
+        updates = [message_update(FIRST_USER_ID + i, args.text) for i in range(args.updates)]
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{args.updates} updates in {elapsed:.2f} s ({args.updates / elapsed:.0f}/s), "
+          f"p99 response {p99 * 1000:.1f} ms, statuses {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--text', default='/start')
+    parser.add_argument('--secret', default='')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
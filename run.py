@@ -1,17 +1,58 @@
 import asyncio
-from aiogram import Bot, Dispatcher
-from setings import TOKEN
+from aiogram import Dispatcher
+from aiogram.filters import ExceptionTypeFilter
+from setings import SCHEDULE_REFRESH_INTERVAL, DB_WRITE_BEHIND, DB_PROFILE_THRESHOLD, RUN_MODE, UPDATES_CONCURRENCY, \
+    UPDATES_IN_FLIGHT, CHAT_QUEUE_SIZE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_BASE_URL, WEBHOOK_SECRET, \
+    METRICS_HOST, METRICS_PORT
 from app.handlers import comands, callback_data, contact, feadback
 from app.admin import admin_router
-from bd.database import init_db
+from app.context import AppContext
+from bd.database import init_db, close_db, migrate_program_titles
+from bd.fsm_storage import SQLiteStorage
+from app.programs import legacy_titles
+from app.utils.schedule import start_schedule_refresher
+from app.utils.webhook import run_webhook
+from app.utils.ordering import ChatEventIsolation, ChatQueueFull, drop_update
+from app.utils.instrumentation import setup_metrics, start_metrics_server
 
 
-async def main():
-    bot = Bot(token=TOKEN)
-    dp = Dispatcher()
-    init_db()
+def create_dispatcher(**workflow_data) -> Dispatcher:
+    """The dispatcher the bot runs with, benchmarks/bench_e2e.py drives the same one"""
+    # FSM state survives restarts: a half-written question or mailing continues after a deploy
+    # Two quick messages of one user must not race each other into duplicate tickets: the second one
+    # waits for its chat's turn before its FSM state is read
+    dp = Dispatcher(storage=SQLiteStorage(), events_isolation=ChatEventIsolation(UPDATES_CONCURRENCY, CHAT_QUEUE_SIZE),
+                    **workflow_data)
     dp.include_routers(comands.router, callback_data.router, contact.router, admin_router, feadback.feedback_router)
-    await dp.start_polling(bot)
+    dp.errors.register(drop_update, ExceptionTypeFilter(ChatQueueFull))
+    setup_metrics(dp)
+    return dp
+
+
+async def main():
+    ctx = AppContext.create()
+    bot = ctx.bot
+    dp = create_dispatcher(**ctx.workflow_data())
+    await init_db(write_behind=DB_WRITE_BEHIND, profile_threshold=DB_PROFILE_THRESHOLD)
+    await migrate_program_titles(legacy_titles())
+    refresher = start_schedule_refresher(SCHEDULE_REFRESH_INTERVAL)
+    # Picks up mailings left unfinished by the previous run
+    mailing = ctx.mailing_worker.start()
+    metrics = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    try:
+        if RUN_MODE == "webhook":
+            await run_webhook(bot, dp, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, UPDATES_IN_FLIGHT,
+                              base_url=WEBHOOK_BASE_URL, secret_token=WEBHOOK_SECRET or None)
+        else:
+            # getUpdates is refused while a webhook is set, e.g. after switching back from webhook mode
+            await bot.delete_webhook()
+            await dp.start_polling(bot, tasks_concurrency_limit=UPDATES_IN_FLIGHT)
+    finally:
+        refresher.cancel()
+        mailing.cancel()
+        if metrics is not None:
+            await metrics.cleanup()
+        await close_db()
     
 if __name__ == '__main__':
     try:
@@ -4,3 +4,18 @@ TOKEN = '7419922790:AAG2Eo8yRjZWM7UD-rpps3MwR4dBuMfQLXc'
 # ADMIN_ID = 5201275315
 PHOTO_PATH = os.path.join(os.path.dirname(__file__), "schedule.png")
 ADMIN_ID = [918717949, 261517607, 5201275315]
+SCHEDULE_REFRESH_INTERVAL = 3600  # Seconds between background schedule refreshes
+DB_WRITE_BEHIND = False  # Batch ticket message and /start writes into short transactions
+DB_PROFILE_THRESHOLD = None  # Seconds; set to log slower statements, capture query plans and enable /slow_queries
+RUN_MODE = "polling"  # "polling" or "webhook"
+UPDATES_CONCURRENCY = 100  # Handlers running at once in either mode
+UPDATES_IN_FLIGHT = 1000  # Updates accepted but not finished, including those waiting for their chat
+CHAT_QUEUE_SIZE = 20  # Updates of one chat waiting their turn, further ones are dropped
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_BASE_URL = ""  # Public https URL Telegram posts to, empty leaves the webhook registration alone
+WEBHOOK_SECRET = ""  # Checked against X-Telegram-Bot-Api-Secret-Token when set
+BOT_API_CONNECTIONS = 120  # Keep-alive connections to the Bot API: UPDATES_CONCURRENCY handlers plus mailing senders
+METRICS_HOST = "127.0.0.1"  # Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics
+METRICS_PORT = 9100  # 0 turns the endpoint off